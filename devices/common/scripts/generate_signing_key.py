@@ -19,18 +19,19 @@ import os
 import sys
 from datetime import datetime
 
-try:
-    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
-    from cryptography.hazmat.primitives import serialization
-except ImportError:
-    print("Error: cryptography package required")
-    print("Install with: pip3 install cryptography")
-    sys.exit(1)
-
 
 def generate_keypair(output_dir: str):
     """Generate Ed25519 keypair and save to files."""
     
+    # Imported here so argument handling does not load the OpenSSL bindings
+    try:
+        from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+        from cryptography.hazmat.primitives import serialization
+    except ImportError:
+        print("Error: cryptography package required")
+        print("Install with: pip3 install cryptography")
+        sys.exit(1)
+    
     # Generate private key
     private_key = Ed25519PrivateKey.generate()
     public_key = private_key.public_key()
@@ -69,6 +70,7 @@ def generate_keypair(output_dir: str):
         f.write(public_pem)
     
     # Generate C header for bootloader
+    key_bytes_c = ['0x%02x' % b for b in public_key_bytes]
     header_path = os.path.join(output_dir, "signing_key_pub.h")
     with open(header_path, "w") as f:
         f.write(f"""/**
@@ -94,8 +96,8 @@ def generate_keypair(output_dir: str):
  * This key is embedded in the bootloader (read-only).
  */
 static const uint8_t agsys_signing_public_key[AGSYS_ED25519_PUBLIC_KEY_SIZE] = {{
-    {', '.join(f'0x{b:02x}' for b in public_key_bytes[:16])},
-    {', '.join(f'0x{b:02x}' for b in public_key_bytes[16:])}
+    {', '.join(key_bytes_c[:16])},
+    {', '.join(key_bytes_c[16:])}
 }};
 
 #endif /* AGSYS_SIGNING_KEY_PUB_H */
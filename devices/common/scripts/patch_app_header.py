@@ -10,9 +10,11 @@ This script:
 5. Recalculates header CRC
 
 Usage:
-    python3 patch_app_header.py <input.bin> [output.bin]
+    python3 patch_app_header.py [--cache header.json] <input.bin> [output.bin]
     
 If output is not specified, input is modified in place.
+With --cache, the header offset found is remembered and checked first on
+the next build instead of scanning the binary.
 
 The header must already contain the magic number (0x59534741 "AGSY").
 Fields fw_size, fw_crc32, and header_crc32 should be 0xFFFFFFFF as placeholders.
@@ -20,7 +22,10 @@ Fields fw_size, fw_crc32, and header_crc32 should be 0xFFFFFFFF as placeholders.
 
 import sys
 import struct
+import binascii
 import argparse
+import json
+import mmap
 from pathlib import Path
 
 # Header constants
@@ -28,21 +33,18 @@ APP_HEADER_MAGIC = 0x59534741  # "AGSY" little-endian
 APP_HEADER_MAGIC_BYTES = struct.pack('<I', APP_HEADER_MAGIC)
 APP_HEADER_SIZE = 48
 
-# CRC32 lookup table (same as firmware)
-CRC_TABLE = [
-    0x00000000, 0x1DB71064, 0x3B6E20C8, 0x26D930AC,
-    0x76DC4190, 0x6B6B51F4, 0x4DB26158, 0x5005713C,
-    0xEDB88320, 0xF00F9344, 0xD6D6A3E8, 0xCB61B38C,
-    0x9B64C2B0, 0x86D3D2D4, 0xA00AE278, 0xBDBDF21C
-]
-
-def crc32(data: bytes) -> int:
-    """Calculate CRC32 using same algorithm as bootloader."""
-    crc = 0xFFFFFFFF
-    for byte in data:
-        crc = CRC_TABLE[(crc ^ byte) & 0x0F] ^ (crc >> 4)
-        crc = CRC_TABLE[(crc ^ (byte >> 4)) & 0x0F] ^ (crc >> 4)
-    return crc ^ 0xFFFFFFFF
+# Header layout, compiled once (must match agsys_app_header.h)
+APP_HEADER_STRUCT = struct.Struct('<I B B B B B B B B I I I I 16s I')
+
+def crc32(data: bytes, crc: int = 0) -> int:
+    """Calculate CRC32 using same algorithm as bootloader (IEEE 802.3).
+    
+    Pass the previous result as crc to continue a running checksum.
+    binascii uses the zlib CRC, which takes the PCLMUL folding path when
+    the interpreter is linked against zlib-ng, and accepts memoryview
+    slices without copying.
+    """
+    return binascii.crc32(data, crc) & 0xFFFFFFFF
 
 def parse_header(data: bytes) -> dict:
     """Parse application header from binary data."""
@@ -50,7 +52,7 @@ def parse_header(data: bytes) -> dict:
         raise ValueError(f"Header data too short: {len(data)} < {APP_HEADER_SIZE}")
     
     # Unpack header fields
-    fields = struct.unpack('<I B B B B B B B B I I I I 16s I', data[:APP_HEADER_SIZE])
+    fields = APP_HEADER_STRUCT.unpack_from(data, 0)
     
     return {
         'magic': fields[0],
@@ -70,11 +72,11 @@ def parse_header(data: bytes) -> dict:
         'header_crc32': fields[14],
     }
 
-def pack_header(hdr: dict) -> bytes:
-    """Pack header dictionary back to binary."""
+def _header_fields(hdr: dict) -> tuple:
+    """Flatten header dictionary into APP_HEADER_STRUCT field order."""
     build_id = hdr['build_id'].encode('ascii')[:16].ljust(16, b'\x00')
     
-    return struct.pack('<I B B B B B B B B I I I I 16s I',
+    return (
         hdr['magic'],
         hdr['header_version'],
         hdr['device_type'],
@@ -92,37 +94,52 @@ def pack_header(hdr: dict) -> bytes:
         hdr['header_crc32'],
     )
 
+def pack_header(hdr: dict) -> bytes:
+    """Pack header dictionary back to binary."""
+    return APP_HEADER_STRUCT.pack(*_header_fields(hdr))
+
+def pack_header_into(buf, offset: int, hdr: dict):
+    """Pack header dictionary directly into a writable buffer at offset."""
+    APP_HEADER_STRUCT.pack_into(buf, offset, *_header_fields(hdr))
+
 def find_header_offset(data: bytes) -> int:
     """Find app header by scanning for magic number."""
     # Search for magic number (align to 4 bytes)
-    offset = 0
-    while offset <= len(data) - APP_HEADER_SIZE:
-        if data[offset:offset+4] == APP_HEADER_MAGIC_BYTES:
+    last = len(data) - APP_HEADER_SIZE
+    offset = data.find(APP_HEADER_MAGIC_BYTES)
+    while 0 <= offset <= last:
+        if offset % 4 == 0:
             return offset
-        offset += 4
+        offset = data.find(APP_HEADER_MAGIC_BYTES, offset + 1)
     return -1
 
-def patch_binary(input_path: Path, output_path: Path, verbose: bool = True) -> bool:
-    """Patch application header in binary file."""
+def patch_buffer(data, verbose: bool = True, header_offset: int = -1) -> int:
+    """
+    Patch application header in a writable firmware buffer (bytearray or mmap).
     
-    # Read binary
-    data = bytearray(input_path.read_bytes())
+    header_offset is an optional hint (e.g. from a previous build); it is used
+    only if the magic is still there, otherwise the binary is scanned.
     
-    # Find header by scanning for magic
-    header_offset = find_header_offset(bytes(data))
+    Returns the header offset, or -1 on error.
+    """
+    
+    # Find header by scanning for magic, unless the hint still matches
+    if (header_offset < 0 or header_offset % 4 != 0 or
+            data[header_offset:header_offset + 4] != APP_HEADER_MAGIC_BYTES):
+        header_offset = find_header_offset(data)
     
     if header_offset < 0:
         print(f"Error: App header magic not found in binary", file=sys.stderr)
         print("Make sure the firmware includes app_header.c with the header in .app_header section",
               file=sys.stderr)
-        return False
+        return -1
     
     if len(data) < header_offset + APP_HEADER_SIZE:
         print(f"Error: Binary too small ({len(data)} bytes)", file=sys.stderr)
-        return False
+        return -1
     
     # Parse header
-    header_data = bytes(data[header_offset:header_offset + APP_HEADER_SIZE])
+    header_data = data[header_offset:header_offset + APP_HEADER_SIZE]
     hdr = parse_header(header_data)
     
     if verbose:
@@ -136,14 +153,16 @@ def patch_binary(input_path: Path, output_path: Path, verbose: bool = True) -> b
     hdr['fw_size'] = fw_size
     
     # Calculate firmware CRC (entire binary, but with header CRCs as 0xFFFFFFFF)
-    # First, temporarily set CRC fields to placeholder
-    temp_data = bytearray(data)
+    # Chain the CRC over pre-header, placeholder header and post-header
+    # regions so the binary is neither copied nor scanned twice
     temp_hdr = hdr.copy()
     temp_hdr['fw_crc32'] = 0xFFFFFFFF
     temp_hdr['header_crc32'] = 0xFFFFFFFF
-    temp_data[header_offset:header_offset + APP_HEADER_SIZE] = pack_header(temp_hdr)
     
-    fw_crc = crc32(bytes(temp_data))
+    with memoryview(data) as view:
+        fw_crc = crc32(view[:header_offset])
+        fw_crc = crc32(pack_header(temp_hdr), fw_crc)
+        fw_crc = crc32(view[header_offset + APP_HEADER_SIZE:], fw_crc)
     hdr['fw_crc32'] = fw_crc
     
     # Calculate header CRC (excludes header_crc32 field itself)
@@ -157,10 +176,46 @@ def patch_binary(input_path: Path, output_path: Path, verbose: bool = True) -> b
         print(f"  Header CRC: 0x{header_crc:08X}")
     
     # Patch header in binary
-    data[header_offset:header_offset + APP_HEADER_SIZE] = pack_header(hdr)
+    pack_header_into(data, header_offset, hdr)
+    
+    return header_offset
+
+def load_cached_offset(cache_path: Path) -> int:
+    """Load header offset recorded by a previous build, or -1."""
+    try:
+        return int(json.loads(cache_path.read_text())['header_offset'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return -1
+
+def save_cached_offset(cache_path: Path, header_offset: int):
+    """Record header offset for the next build."""
+    cache_path.write_text(json.dumps({'header_offset': header_offset}))
+
+def patch_binary(input_path: Path, output_path: Path, verbose: bool = True,
+                 cache_path: Path = None) -> bool:
+    """Patch application header in binary file."""
     
-    # Write output
-    output_path.write_bytes(bytes(data))
+    cached_offset = load_cached_offset(cache_path) if cache_path else -1
+    
+    if output_path.resolve() == input_path.resolve() and input_path.stat().st_size > 0:
+        # In place: map the file so only the dirty header page is written back
+        with open(input_path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as data:
+            header_offset = patch_buffer(data, verbose, cached_offset)
+            if header_offset < 0:
+                return False
+            data.flush()
+    else:
+        # Read binary
+        data = bytearray(input_path.read_bytes())
+        header_offset = patch_buffer(data, verbose, cached_offset)
+        if header_offset < 0:
+            return False
+        
+        # Write output
+        output_path.write_bytes(data)
+    
+    if cache_path and header_offset != cached_offset:
+        save_cached_offset(cache_path, header_offset)
     
     if verbose:
         print(f"Patched binary written to {output_path}")
@@ -174,6 +229,8 @@ def main():
     parser.add_argument('input', type=Path, help='Input binary file')
     parser.add_argument('output', type=Path, nargs='?', help='Output binary file (default: modify in place)')
     parser.add_argument('-q', '--quiet', action='store_true', help='Suppress output')
+    parser.add_argument('--cache', type=Path,
+                        help='Cache file remembering the header offset between builds')
     
     args = parser.parse_args()
     
@@ -183,7 +240,7 @@ def main():
     
     output = args.output or args.input
     
-    if patch_binary(args.input, output, verbose=not args.quiet):
+    if patch_binary(args.input, output, verbose=not args.quiet, cache_path=args.cache):
         sys.exit(0)
     else:
         sys.exit(1)
@@ -5,7 +5,7 @@ AgSys Firmware Signing Tool
 Signs a firmware binary using Ed25519 and creates a release package.
 
 Usage:
-    python3 sign_firmware.py <firmware.bin> <private_key.pem> [output_dir]
+    python3 sign_firmware.py [--skip-verify] <firmware.bin> <private_key.pem> [output_dir]
 
 Output:
     <output_dir>/
@@ -17,11 +17,15 @@ Output:
 The signature is computed over SHA256(firmware.bin).
 """
 
+import binascii
+import contextlib
 import hashlib
 import json
+import mmap
 import os
 import shutil
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
 try:
@@ -32,6 +36,9 @@ except ImportError:
     print("Install with: pip3 install cryptography")
     sys.exit(1)
 
+# Read size for the pre-3.11 SHA256 fallback
+CHECKSUM_BLOCK_SIZE = 1 << 20
+
 
 def load_private_key(key_path: str) -> Ed25519PrivateKey:
     """Load Ed25519 private key from PEM file."""
@@ -44,34 +51,96 @@ def load_private_key(key_path: str) -> Ed25519PrivateKey:
     return private_key
 
 
-def compute_sha256(data: bytes) -> str:
-    """Compute SHA256 hash and return hex string."""
-    return hashlib.sha256(data).hexdigest()
+def compute_sha256(f) -> str:
+    """Compute SHA256 of an open binary file and return hex string."""
+    if hasattr(hashlib, "file_digest"):
+        # Python 3.11+: hashed in C with the GIL released
+        return hashlib.file_digest(f, "sha256").hexdigest()
+    
+    sha256 = hashlib.sha256()
+    for block in iter(lambda: f.read(CHECKSUM_BLOCK_SIZE), b""):
+        sha256.update(block)
+    return sha256.hexdigest()
 
 
 def compute_crc32(data: bytes) -> int:
     """Compute CRC32 checksum."""
-    import binascii
     return binascii.crc32(data) & 0xffffffff
 
 
-def sign_firmware(firmware_path: str, key_path: str, output_dir: str):
-    """Sign firmware and create release package."""
+def sign_buffer(private_key: Ed25519PrivateKey, data) -> bytes:
+    """
+    Ed25519-sign a buffer (e.g. an mmap) without copying it.
     
-    # Load firmware
-    with open(firmware_path, "rb") as f:
-        firmware_data = f.read()
+    Older cryptography releases only accept bytes, so fall back to a copy.
+    """
+    try:
+        return private_key.sign(data)
+    except TypeError:
+        return private_key.sign(bytes(data))
+
+
+def map_firmware(f):
+    """
+    Map an open firmware file read-only, for use as a context manager.
+    
+    mmap cannot map an empty file, so an empty image is returned as b"".
+    """
+    if os.fstat(f.fileno()).st_size == 0:
+        return contextlib.nullcontext(b"")
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def copy_file(src_path: str, dst_path: str):
+    """
+    Copy file contents in the kernel, without copying metadata.
+    
+    Uses copy_file_range (a reflink on CoW filesystems) where available and
+    falls back to shutil.copyfile, which uses sendfile on Linux.
+    """
+    if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path):
+        raise shutil.SameFileError(f"{src_path} and {dst_path} are the same file")
     
-    firmware_size = len(firmware_data)
-    firmware_sha256 = compute_sha256(firmware_data)
-    firmware_crc32 = compute_crc32(firmware_data)
+    if hasattr(os, "copy_file_range"):
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            remaining = os.fstat(src.fileno()).st_size
+            try:
+                while remaining > 0:
+                    copied = os.copy_file_range(src.fileno(), dst.fileno(), remaining)
+                    if copied == 0:
+                        break
+                    remaining -= copied
+                return
+            except OSError:
+                pass  # e.g. unsupported filesystem; fall through
+    
+    shutil.copyfile(src_path, dst_path)
+
+
+def sign_firmware(firmware_path: str, key_path: str, output_dir: str):
+    """Sign firmware and create release package."""
     
     # Load private key
     private_key = load_private_key(key_path)
     
-    # Sign the firmware (Ed25519 signs the message directly, but we sign the hash for consistency)
-    # Actually, Ed25519 internally hashes, so we sign the raw firmware
-    signature = private_key.sign(firmware_data)
+    # Map firmware read-only; CRC reads the mapping directly without a heap copy
+    with open(firmware_path, "rb") as f, \
+            map_firmware(f) as firmware_data:
+        firmware_size = len(firmware_data)
+        
+        # SHA256, CRC32 and signing are independent passes that release the
+        # GIL in C, so run them concurrently
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            sha256_future = executor.submit(compute_sha256, f)
+            crc32_future = executor.submit(compute_crc32, firmware_data)
+            
+            # Sign the firmware (Ed25519 signs the message directly, but we sign the hash for consistency)
+            # Actually, Ed25519 internally hashes, so we sign the raw firmware
+            signature_future = executor.submit(sign_buffer, private_key, firmware_data)
+            
+            firmware_sha256 = sha256_future.result()
+            firmware_crc32 = crc32_future.result()
+            signature = signature_future.result()
     
     # Get public key for verification info
     public_key = private_key.public_key()
@@ -89,7 +158,7 @@ def sign_firmware(firmware_path: str, key_path: str, output_dir: str):
     
     # Copy firmware
     output_firmware = os.path.join(output_dir, firmware_basename)
-    shutil.copy2(firmware_path, output_firmware)
+    copy_file(firmware_path, output_firmware)
     
     # Write signature
     sig_path = os.path.join(output_dir, f"{name_without_ext}.sig")
@@ -163,20 +232,27 @@ def verify_signature(firmware_path: str, sig_path: str, public_key_hex: str) ->
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("Usage: sign_firmware.py <firmware.bin> <private_key.pem> [output_dir]")
+    args = sys.argv[1:]
+    skip_verify = "--skip-verify" in args
+    args = [a for a in args if a != "--skip-verify"]
+    
+    if len(args) < 2:
+        print("Usage: sign_firmware.py [--skip-verify] <firmware.bin> <private_key.pem> [output_dir]")
         print()
         print("Arguments:")
         print("  firmware.bin    - Firmware binary to sign")
         print("  private_key.pem - Ed25519 private key")
         print("  output_dir      - Output directory (default: same as firmware)")
+        print()
+        print("Options:")
+        print("  --skip-verify   - Don't re-verify the signature after signing (CI)")
         sys.exit(1)
     
-    firmware_path = sys.argv[1]
-    key_path = sys.argv[2]
+    firmware_path = args[0]
+    key_path = args[1]
     
-    if len(sys.argv) > 3:
-        output_dir = sys.argv[3]
+    if len(args) > 2:
+        output_dir = args[2]
     else:
         # Default: create directory next to firmware with same name
         firmware_basename = os.path.basename(firmware_path)
@@ -195,7 +271,7 @@ def main():
     # Sign
     success = sign_firmware(firmware_path, key_path, output_dir)
     
-    if success:
+    if success and not skip_verify:
         # Verify the signature we just created
         manifest_path = os.path.join(output_dir, "manifest.json")
         with open(manifest_path, "r") as f:
@@ -5,14 +5,39 @@ Provides HTTP endpoints for monitoring and controlling the IoT system.
 """
 
 import os
+import time
 import logging
-from flask import Flask, jsonify, request
+import orjson
+from flask import Flask, Response, jsonify, request
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from waitress import serve
 from controller import Controller
 
 logger = logging.getLogger(__name__)
 
+# Worker threads for the production WSGI server
+API_THREADS = 8
+
+# Keep-alive interval for idle progress streams
+OTA_STREAM_KEEPALIVE_SEC = 15
+
+# Streams hold a server worker thread; clients reconnect after this long
+OTA_STREAM_MAX_SEC = 300
+
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson."""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 CORS(app)
 
 # Global controller instance
@@ -93,6 +118,36 @@ def get_ota_progress():
     return jsonify(controller.get_ota_progress())
 
 
+@app.route('/api/ota/progress/stream', methods=['GET'])
+def stream_ota_progress():
+    """
+    Stream OTA progress as server-sent events, one event per change.
+    
+    The stream ends once no session is active or after OTA_STREAM_MAX_SEC,
+    so idle streams don't tie up the server's worker threads.
+    """
+    def generate():
+        deadline = time.monotonic() + OTA_STREAM_MAX_SEC
+        version = -1
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            new_version = controller.wait_ota_progress(
+                version, min(OTA_STREAM_KEEPALIVE_SEC, remaining)
+            )
+            if new_version == version:
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            progress = controller.get_ota_progress()
+            yield f"data: {orjson.dumps(progress).decode()}\n\n"
+            if not progress.get("active"):
+                return
+    
+    return Response(generate(), mimetype='text/event-stream')
+
+
 @app.route('/api/ota/devices', methods=['GET'])
 def get_ota_devices():
     """Get OTA status for all devices."""
@@ -102,7 +157,11 @@ def get_ota_devices():
 def run_api(host: str = '0.0.0.0', port: int = 5000, debug: bool = False):
     """Run the API server."""
     init_controller()
-    app.run(host=host, port=port, debug=debug, threaded=True)
+    if debug:
+        # Werkzeug dev server for the debugger/reloader
+        app.run(host=host, port=port, debug=debug, threaded=True)
+    else:
+        serve(app, host=host, port=port, threads=API_THREADS)
 
 
 if __name__ == '__main__':
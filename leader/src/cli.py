@@ -9,8 +9,17 @@ import argparse
 import sys
 import time
 import logging
+from operator import itemgetter
 from controller import Controller
 
+# Row formats for tabular listings
+DEVICE_ROW_FORMAT = '%-36s %-15s %-20.19s %-10s %-8s'
+DEVICE_ROW_FIELDS = itemgetter('uuid', 'device_type', 'last_seen', 'battery_mv', 'rssi')
+DATA_ROW_FORMAT = '%-20.19s %3s%% (%-4s) %-10s %-8.1f %-8s'
+DATA_ROW_FIELDS = itemgetter(
+    'timestamp', 'moisture_percent', 'moisture_raw', 'battery_mv', 'temperature', 'rssi'
+)
+
 
 def cmd_run(args):
     """Run the controller in foreground."""
@@ -40,11 +49,12 @@ def cmd_devices(args):
         print("No devices registered")
         return
     
-    print(f"{'UUID':<36} {'Type':<15} {'Last Seen':<20} {'Battery':<10} {'RSSI':<8}")
-    print("-" * 95)
-    
-    for d in devices:
-        print(f"{d['uuid']:<36} {d['device_type']:<15} {d['last_seen'][:19]:<20} {d['battery_mv']:<10} {d['rssi']:<8}")
+    lines = [
+        f"{'UUID':<36} {'Type':<15} {'Last Seen':<20} {'Battery':<10} {'RSSI':<8}",
+        "-" * 95,
+    ]
+    lines.extend(DEVICE_ROW_FORMAT % DEVICE_ROW_FIELDS(d) for d in devices)
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 def cmd_ota_start(args):
@@ -74,26 +84,28 @@ def cmd_ota_start(args):
         print("Press Ctrl+C to stop.")
         print()
         
-        last_progress = {}
+        progress_version = -1
         while True:
+            # Wake on each progress change, and at least once a second so
+            # the elapsed time keeps ticking between changes
+            progress_version = controller.wait_ota_progress(progress_version, timeout=1.0)
             progress = controller.get_ota_progress()
             
             if not progress.get('active'):
+                if progress.get('error'):
+                    print(f"\nOTA update failed: {progress['error']}")
+                    sys.exit(1)
                 print("\nOTA session completed.")
                 break
             
             # Print progress update
-            if progress != last_progress:
-                print(
-                    f"\rDevices: {progress['devices_receiving']} receiving, "
-                    f"{progress['devices_complete']} complete, "
-                    f"{progress['devices_error']} errors | "
-                    f"Elapsed: {progress['elapsed_sec']}s",
-                    end='', flush=True
-                )
-                last_progress = progress
-            
-            time.sleep(1)
+            print(
+                f"\rDevices: {progress['devices_receiving']} receiving, "
+                f"{progress['devices_complete']} complete, "
+                f"{progress['devices_error']} errors | "
+                f"Elapsed: {progress['elapsed_sec']}s",
+                end='', flush=True
+            )
         
         # Print final status
         print("\nFinal device status:")
@@ -154,17 +166,12 @@ def cmd_data(args):
         print(f"No data for device {args.uuid}")
         return
     
-    print(f"{'Timestamp':<20} {'Moisture':<10} {'Battery':<10} {'Temp':<8} {'RSSI':<8}")
-    print("-" * 60)
-    
-    for d in data:
-        print(
-            f"{d['timestamp'][:19]:<20} "
-            f"{d['moisture_percent']:>3}% ({d['moisture_raw']:<4}) "
-            f"{d['battery_mv']:<10} "
-            f"{d['temperature']:<8.1f} "
-            f"{d['rssi']:<8}"
-        )
+    lines = [
+        f"{'Timestamp':<20} {'Moisture':<10} {'Battery':<10} {'Temp':<8} {'RSSI':<8}",
+        "-" * 60,
+    ]
+    lines.extend(DATA_ROW_FORMAT % DATA_ROW_FIELDS(d) for d in data)
+    sys.stdout.write('\n'.join(lines) + '\n')
 
 
 def main():
@@ -12,14 +12,17 @@ import json
 import logging
 import threading
 import sqlite3
+import queue
 from datetime import datetime
 from typing import Optional, Dict, List
 from dataclasses import dataclass
+from itertools import groupby
+from operator import itemgetter
 
 from lora_driver import LoRaDriver
 from protocol import (
     Protocol, MessageType, DeviceType, PacketHeader,
-    SensorReport, AckFlag, uuid_to_str
+    SensorReport, AckFlag, uuid_to_str, str_to_uuid
 )
 from ota_manager import OtaManager
 
@@ -30,6 +33,34 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Database writes are queued and committed by the writer thread in one
+# transaction per interval (or sooner once the queue is this long)
+DB_FLUSH_INTERVAL_SEC = 0.1
+DB_FLUSH_MAX_ITEMS = 500
+
+# Flushes a write may fail with a transient error (locked, I/O) before it
+# is dropped
+DB_WRITE_MAX_RETRIES = 5
+
+# Write statements, kept as constants so sqlite3's statement cache
+# reuses the compiled form instead of re-preparing each call
+INSERT_SENSOR_DATA_SQL = (
+    'INSERT INTO sensor_data (device_uuid, timestamp, moisture_raw, moisture_percent, '
+    'battery_mv, temperature, rssi) VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+INSERT_DEVICE_SQL = (
+    'INSERT INTO devices (uuid, device_type, first_seen, last_seen, firmware_version, '
+    'battery_mv, rssi) VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+UPDATE_DEVICE_SQL = 'UPDATE devices SET last_seen = ?, battery_mv = ?, rssi = ? WHERE uuid = ?'
+INSERT_OTA_HISTORY_SQL = (
+    'INSERT INTO ota_history (announce_id, firmware_path, version, start_time, end_time, '
+    'devices_success, devices_failed) VALUES (?, ?, ?, ?, ?, ?, ?)'
+)
+
+# Device type value -> name, for API output
+_DEVICE_TYPE_NAME = {t.value: t.name for t in DeviceType}
+
 
 @dataclass
 class DeviceInfo:
@@ -51,9 +82,16 @@ class Controller:
         self.lora: Optional[LoRaDriver] = None
         self.protocol = Protocol()
         self.ota_manager: Optional[OtaManager] = None
-        self.devices: Dict[str, DeviceInfo] = {}
+        self.devices: Dict[bytes, DeviceInfo] = {}  # Keyed by raw UUID
         self._running = False
         self._rx_thread: Optional[threading.Thread] = None
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+        self._db_queue: queue.Queue = queue.Queue()
+        self._db_retry: List[tuple] = []  # Writes kept from a failed flush
+        self._db_retry_count = 0
+        self._flush_thread: Optional[threading.Thread] = None
+        self._flush_wake = threading.Event()
         
         # Initialize database
         self._init_database()
@@ -80,7 +118,7 @@ class Controller:
             return False
         
         # Initialize OTA manager
-        self.ota_manager = OtaManager(self.protocol, self._send_packet)
+        self.ota_manager = OtaManager(self.protocol, self._send_packet, self._send_packets)
         self.ota_manager.on_device_complete = self._on_ota_device_complete
         self.ota_manager.on_session_complete = self._on_ota_session_complete
         self.ota_manager.on_progress = self._on_ota_progress
@@ -90,6 +128,10 @@ class Controller:
         self._rx_thread = threading.Thread(target=self._receive_loop, daemon=True)
         self._rx_thread.start()
         
+        # Start database writer
+        self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._flush_thread.start()
+        
         logger.info("Controller started successfully")
         return True
     
@@ -104,9 +146,21 @@ class Controller:
         if self._rx_thread:
             self._rx_thread.join(timeout=2.0)
         
+        if self._flush_thread:
+            self._flush_wake.set()
+            self._flush_thread.join(timeout=2.0)
+            self._flush_thread = None
+        
         if self.lora:
             self.lora.end()
         
+        self._flush_db_queue()
+        
+        with self._db_lock:
+            if self._db:
+                self._db.close()
+                self._db = None
+        
         logger.info("Controller stopped")
     
     def start_ota_update(
@@ -142,6 +196,18 @@ class Controller:
             return self.ota_manager.get_progress()
         return {"active": False}
     
+    def wait_ota_progress(self, version: int, timeout: Optional[float] = None) -> int:
+        """
+        Wait for the OTA progress to change from version.
+        
+        Returns the new progress version (unchanged on timeout).
+        """
+        if self.ota_manager:
+            return self.ota_manager.wait_for_progress(version, timeout)
+        if timeout:
+            time.sleep(timeout)
+        return version
+    
     def get_ota_device_status(self) -> List[dict]:
         """Get OTA status for all devices."""
         if self.ota_manager:
@@ -153,7 +219,7 @@ class Controller:
         return [
             {
                 "uuid": d.uuid,
-                "device_type": DeviceType(d.device_type).name if d.device_type in DeviceType._value2member_map_ else str(d.device_type),
+                "device_type": _DEVICE_TYPE_NAME.get(d.device_type) or str(d.device_type),
                 "first_seen": d.first_seen.isoformat(),
                 "last_seen": d.last_seen.isoformat(),
                 "firmware_version": d.firmware_version,
@@ -165,31 +231,24 @@ class Controller:
     
     def get_sensor_data(self, uuid: str, limit: int = 100) -> List[dict]:
         """Get sensor data for a device."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT timestamp, moisture_raw, moisture_percent, battery_mv, temperature, rssi
-            FROM sensor_data
-            WHERE device_uuid = ?
-            ORDER BY timestamp DESC
-            LIMIT ?
-        ''', (uuid, limit))
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "timestamp": row[0],
-                "moisture_raw": row[1],
-                "moisture_percent": row[2],
-                "battery_mv": row[3],
-                "temperature": row[4] / 10.0,  # Convert from 0.1°C
-                "rssi": row[5]
-            }
-            for row in rows
-        ]
+        self._flush_db_queue()
+        
+        # Timestamp formatting (epoch ms -> local ISO) and the 0.1°C
+        # temperature conversion are done by SQLite
+        with self._db_lock:
+            rows = self._db.execute('''
+                SELECT strftime('%Y-%m-%dT%H:%M:%f', timestamp / 1000.0, 'unixepoch', 'localtime')
+                           AS timestamp,
+                       moisture_raw, moisture_percent, battery_mv,
+                       temperature / 10.0 AS temperature,
+                       rssi
+                FROM sensor_data
+                WHERE device_uuid = ?
+                ORDER BY sensor_data.timestamp DESC
+                LIMIT ?
+            ''', (uuid, limit)).fetchall()
+        
+        return [dict(row) for row in rows]
     
     def _send_packet(self, data: bytes) -> bool:
         """Send a LoRa packet."""
@@ -197,15 +256,23 @@ class Controller:
             return self.lora.send(data)
         return False
     
+    def _send_packets(self, packets: List[bytes]) -> int:
+        """Send a batch of LoRa packets. Returns the number sent."""
+        if self.lora and packets:
+            return self.lora.send_many(packets)
+        return 0
+    
     def _receive_loop(self):
         """Background receive loop."""
         while self._running:
-            result = self.lora.receive(timeout_ms=100)
+            # Blocks on the DIO0 interrupt; the timeout only bounds how long
+            # a stop() request waits
+            result = self.lora.receive(timeout_ms=500)
             if result:
                 data, rssi = result
                 self._handle_packet(data, rssi)
     
-    def _handle_packet(self, data: bytes, rssi: int):
+    def _handle_packet(self, data: memoryview, rssi: int):
         """Handle a received packet."""
         result = self.protocol.parse_packet(data)
         if not result:
@@ -213,9 +280,12 @@ class Controller:
             return
         
         header, payload = result
-        uuid_str = uuid_to_str(header.uuid)
         
-        logger.debug(f"RX from {uuid_str[:16]}...: type={header.msg_type}, len={len(payload)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "RX from %s...: type=%d, len=%d",
+                header.uuid[:8].hex(), header.msg_type, len(payload)
+            )
         
         # Handle OTA messages
         if header.msg_type >= MessageType.OTA_ANNOUNCE:
@@ -234,13 +304,13 @@ class Controller:
             logger.warning("Failed to parse sensor report")
             return
         
-        uuid_str = uuid_to_str(header.uuid)
         now = datetime.now()
         
-        # Update device info
-        if uuid_str not in self.devices:
-            self.devices[uuid_str] = DeviceInfo(
-                uuid=uuid_str,
+        # Update device info; known devices reuse their stored hex UUID
+        device = self.devices.get(header.uuid)
+        if device is None:
+            device = DeviceInfo(
+                uuid=uuid_to_str(header.uuid),
                 device_type=header.device_type,
                 first_seen=now,
                 last_seen=now,
@@ -248,23 +318,21 @@ class Controller:
                 battery_mv=report.battery_mv,
                 rssi=rssi
             )
-            self._save_device(self.devices[uuid_str])
-            logger.info(f"New device registered: {uuid_str[:16]}...")
+            self.devices[header.uuid] = device
+            self._save_device(device)
+            logger.info("New device registered: %.16s...", device.uuid)
         else:
-            device = self.devices[uuid_str]
             device.last_seen = now
             device.battery_mv = report.battery_mv
             device.rssi = rssi
             self._update_device(device)
         
         # Store sensor data
-        self._store_sensor_data(uuid_str, report, rssi)
+        self._store_sensor_data(device.uuid, report, rssi)
         
         logger.info(
-            f"Sensor report from {uuid_str[:16]}...: "
-            f"moisture={report.moisture_percent}%, "
-            f"battery={report.battery_mv}mV, "
-            f"rssi={rssi}dBm"
+            "Sensor report from %.16s...: moisture=%d%%, battery=%dmV, rssi=%ddBm",
+            device.uuid, report.moisture_percent, report.battery_mv, rssi
         )
         
         # Send ACK
@@ -276,9 +344,20 @@ class Controller:
         self._send_packet(ack_packet)
     
     def _init_database(self):
-        """Initialize SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        """Open the persistent SQLite connection and create tables."""
+        # One long-lived connection, serialized by _db_lock. Writes come
+        # from the writer thread; the API threads only read. Autocommit
+        # mode with WAL and synchronous=NORMAL avoids a full fsync per
+        # sensor packet.
+        self._db = sqlite3.connect(
+            self.db_path, check_same_thread=False, isolation_level=None
+        )
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA temp_store=MEMORY')
+        self._db.execute('PRAGMA cache_size=-8000')
+        self._db.row_factory = sqlite3.Row
+        cursor = self._db.cursor()
         
         # Devices table
         cursor.execute('''
@@ -298,7 +377,7 @@ class Controller:
             CREATE TABLE IF NOT EXISTS sensor_data (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 device_uuid TEXT,
-                timestamp TEXT,
+                timestamp INTEGER,
                 moisture_raw INTEGER,
                 moisture_percent INTEGER,
                 battery_mv INTEGER,
@@ -308,6 +387,42 @@ class Controller:
             )
         ''')
         
+        # Databases created before timestamps became epoch milliseconds
+        # stored local-time ISO strings; rebuild the table with converted
+        # values so ordering and the INTEGER column affinity hold
+        columns = {row[1]: row[2] for row in cursor.execute('PRAGMA table_info(sensor_data)')}
+        if columns.get('timestamp') == 'TEXT':
+            logger.info("Migrating sensor_data timestamps to epoch milliseconds")
+            cursor.executescript('''
+                BEGIN;
+                DROP INDEX IF EXISTS idx_sensor_data_uuid_ts;
+                ALTER TABLE sensor_data RENAME TO sensor_data_old;
+                CREATE TABLE sensor_data (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device_uuid TEXT,
+                    timestamp INTEGER,
+                    moisture_raw INTEGER,
+                    moisture_percent INTEGER,
+                    battery_mv INTEGER,
+                    temperature INTEGER,
+                    rssi INTEGER,
+                    FOREIGN KEY (device_uuid) REFERENCES devices(uuid)
+                );
+                INSERT INTO sensor_data
+                SELECT id, device_uuid,
+                       CAST(ROUND((julianday(timestamp, 'utc') - 2440587.5) * 86400000) AS INTEGER),
+                       moisture_raw, moisture_percent, battery_mv, temperature, rssi
+                FROM sensor_data_old;
+                DROP TABLE sensor_data_old;
+                COMMIT;
+            ''')
+        
+        # Serves get_sensor_data's per-device, newest-first lookup
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sensor_data_uuid_ts
+            ON sensor_data (device_uuid, timestamp DESC)
+        ''')
+        
         # OTA history table
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS ota_history (
@@ -322,20 +437,15 @@ class Controller:
             )
         ''')
         
-        conn.commit()
-        conn.close()
         logger.info(f"Database initialized: {self.db_path}")
     
     def _load_devices(self):
         """Load known devices from database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM devices')
-        rows = cursor.fetchall()
+        with self._db_lock:
+            rows = self._db.execute('SELECT * FROM devices').fetchall()
         
         for row in rows:
-            self.devices[row[0]] = DeviceInfo(
+            self.devices[str_to_uuid(row[0])] = DeviceInfo(
                 uuid=row[0],
                 device_type=row[1],
                 first_seen=datetime.fromisoformat(row[2]),
@@ -345,18 +455,11 @@ class Controller:
                 rssi=row[6]
             )
         
-        conn.close()
         logger.info(f"Loaded {len(self.devices)} devices from database")
     
     def _save_device(self, device: DeviceInfo):
-        """Save a new device to database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO devices (uuid, device_type, first_seen, last_seen, firmware_version, battery_mv, rssi)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Queue a new device for saving to database."""
+        self._queue_write(INSERT_DEVICE_SQL, (
             device.uuid,
             device.device_type,
             device.first_seen.isoformat(),
@@ -365,53 +468,121 @@ class Controller:
             device.battery_mv,
             device.rssi
         ))
-        
-        conn.commit()
-        conn.close()
     
     def _update_device(self, device: DeviceInfo):
-        """Update device in database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            UPDATE devices
-            SET last_seen = ?, battery_mv = ?, rssi = ?
-            WHERE uuid = ?
-        ''', (
+        """Queue a device update for the database."""
+        self._queue_write(UPDATE_DEVICE_SQL, (
             device.last_seen.isoformat(),
             device.battery_mv,
             device.rssi,
             device.uuid
         ))
-        
-        conn.commit()
-        conn.close()
     
     def _store_sensor_data(self, uuid: str, report: SensorReport, rssi: int):
-        """Store sensor data in database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO sensor_data (device_uuid, timestamp, moisture_raw, moisture_percent, battery_mv, temperature, rssi)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        """Queue sensor data for the next batched database write."""
+        self._queue_write(INSERT_SENSOR_DATA_SQL, (
             uuid,
-            datetime.now().isoformat(),
+            time.time_ns() // 1_000_000,  # Epoch ms; formatted on read
             report.moisture_raw,
             report.moisture_percent,
             report.battery_mv,
             report.temperature,
             rssi
         ))
+    
+    def _queue_write(self, sql: str, params: tuple):
+        """Hand a write statement to the database writer thread."""
+        self._db_queue.put((sql, params))
+        if self._db_queue.qsize() >= DB_FLUSH_MAX_ITEMS:
+            self._flush_wake.set()
+    
+    def _flush_db_queue(self):
+        """Execute all queued writes in a single transaction."""
+        with self._db_lock:
+            if not self._db:
+                return
+            
+            # Drain under the lock so concurrent flushes keep write order;
+            # writes kept from a failed flush go first
+            items = self._db_retry
+            self._db_retry = []
+            try:
+                while True:
+                    items.append(self._db_queue.get_nowait())
+            except queue.Empty:
+                pass
+            
+            if not items:
+                return
+            
+            try:
+                self._execute_batch(items)
+                self._db_retry_count = 0
+            except sqlite3.Error as e:
+                # Find the failing statement instead of losing the whole batch
+                logger.warning(
+                    "Batched write of %d statements failed (%s), retrying one by one",
+                    len(items), e
+                )
+                self._execute_each(items)
+    
+    def _execute_batch(self, items: List[tuple]):
+        """Run (sql, params) writes in one transaction. Caller holds _db_lock."""
+        self._db.execute('BEGIN')
+        try:
+            # Consecutive writes of the same statement go in one executemany
+            for sql, group in groupby(items, key=itemgetter(0)):
+                self._db.executemany(sql, [params for _, params in group])
+            self._db.execute('COMMIT')
+        except sqlite3.Error:
+            # Don't let a failed rollback hide the original error
+            if self._db.in_transaction:
+                try:
+                    self._db.execute('ROLLBACK')
+                except sqlite3.Error as e:
+                    logger.error("Rollback failed: %s", e)
+            raise
+    
+    def _execute_each(self, items: List[tuple]):
+        """
+        Run (sql, params) writes one at a time in autocommit. Caller holds
+        _db_lock.
         
-        conn.commit()
-        conn.close()
+        Writes the database rejects outright are logged and dropped. On an
+        OperationalError (locked database, I/O error) the remaining writes
+        are kept for the next flush, up to DB_WRITE_MAX_RETRIES times.
+        """
+        for i, (sql, params) in enumerate(items):
+            try:
+                self._db.execute(sql, params)
+            except sqlite3.OperationalError as e:
+                self._db_retry_count += 1
+                if self._db_retry_count < DB_WRITE_MAX_RETRIES:
+                    logger.error(
+                        "Database write failed (%s), keeping %d writes for retry",
+                        e, len(items) - i
+                    )
+                    self._db_retry = items[i:]
+                    return
+                logger.error("Dropping database write after %d attempts: %s", self._db_retry_count, e)
+            except sqlite3.Error as e:
+                logger.error("Dropping rejected database write: %s", e)
+            self._db_retry_count = 0
+    
+    def _flush_loop(self):
+        """Background database writer loop."""
+        while self._running:
+            self._flush_wake.wait(timeout=DB_FLUSH_INTERVAL_SEC)
+            self._flush_wake.clear()
+            try:
+                self._flush_db_queue()
+            except Exception:
+                # Keep the writer alive; nothing else would drain the queue
+                logger.exception("Failed to write to database")
     
-    def _on_ota_device_complete(self, uuid: str):
+    def _on_ota_device_complete(self, uuid: bytes):
         """Callback when a device completes OTA."""
-        logger.info(f"Device {uuid[:16]}... completed OTA update")
+        logger.info(f"Device {uuid[:8].hex()}... completed OTA update")
     
     def _on_ota_session_complete(self, success: int, failed: int):
         """Callback when OTA session completes."""
@@ -419,14 +590,8 @@ class Controller:
         
         # Store in history
         if self.ota_manager and self.ota_manager.session:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
             session = self.ota_manager.session
-            cursor.execute('''
-                INSERT INTO ota_history (announce_id, firmware_path, version, start_time, end_time, devices_success, devices_failed)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
+            self._queue_write(INSERT_OTA_HISTORY_SQL, (
                 session.announce_id,
                 session.firmware_path,
                 f"{session.version[0]}.{session.version[1]}.{session.version[2]}",
@@ -435,15 +600,14 @@ class Controller:
                 success,
                 failed
             ))
-            
-            conn.commit()
-            conn.close()
     
-    def _on_ota_progress(self, uuid: str, chunk: int, total: int):
+    def _on_ota_progress(self, uuid: bytes, chunk: int, total: int):
         """Callback for OTA progress updates."""
-        percent = int(chunk * 100 / total)
         if chunk % 50 == 0 or chunk == total:  # Log every 50 chunks
-            logger.info(f"OTA progress {uuid[:16]}...: {chunk}/{total} ({percent}%)")
+            logger.info(
+                "OTA progress %s...: %d/%d (%d%%)",
+                uuid[:8].hex(), chunk, total, chunk * 100 // total
+            )
 
 
 def main():
@@ -8,6 +8,7 @@ import spidev
 import RPi.GPIO as GPIO
 import time
 import threading
+from collections import deque
 from typing import Optional, Callable, List
 
 # RFM95C Register Addresses
@@ -52,6 +53,10 @@ IRQ_TX_DONE = 0x08
 IRQ_RX_DONE = 0x40
 IRQ_PAYLOAD_CRC_ERROR = 0x20
 
+# DIO0 mapping (REG_DIO_MAPPING_1 bits 7-6)
+DIO0_RX_DONE = 0x00
+DIO0_TX_DONE = 0x40
+
 # PA Config
 PA_BOOST = 0x80
 
@@ -71,7 +76,8 @@ class LoRaDriver:
         spreading_factor: int = 10,
         bandwidth: int = 125_000,
         coding_rate: int = 5,
-        sync_word: int = 0x34
+        sync_word: int = 0x34,
+        spi_speed_hz: int = 8_000_000  # RFM95 allows up to 10 MHz
     ):
         self.spi_bus = spi_bus
         self.spi_device = spi_device
@@ -84,12 +90,34 @@ class LoRaDriver:
         self.bandwidth = bandwidth
         self.coding_rate = coding_rate
         self.sync_word = sync_word
+        self.spi_speed_hz = spi_speed_hz
         
         self.spi: Optional[spidev.SpiDev] = None
-        self._rx_callback: Optional[Callable[[bytes, int], None]] = None
+        self._rx_callback: Optional[Callable[[memoryview, int], None]] = None
         self._rx_thread: Optional[threading.Thread] = None
         self._running = False
+        
+        # _lock serializes whole send/receive sequences (radio mode owner);
+        # _spi_lock covers only a single SPI transaction, so register reads
+        # from other threads can interleave while a send/receive is waiting
         self._lock = threading.Lock()
+        self._spi_lock = threading.Lock()
+        
+        # Shadow copies of MODEM_CONFIG_1/2 (chip reset defaults) so field
+        # updates don't need a read-modify-write over SPI
+        self._modem_config_1 = 0x72
+        self._modem_config_2 = 0x70
+        
+        # FRF register bytes for the configured carrier, computed once
+        self._frf_bytes = self._compute_frf(frequency)
+        
+        # Set from the DIO0 interrupt
+        self._mode = MODE_SLEEP
+        self._tx_done = threading.Event()
+        self._rx_done = threading.Event()
+        
+        # Packets pulled out of the FIFO before a send reused it (under _lock)
+        self._pending_rx: deque = deque()
         
     def begin(self) -> bool:
         """Initialize the LoRa module."""
@@ -98,6 +126,7 @@ class LoRaDriver:
         GPIO.setwarnings(False)
         GPIO.setup(self.reset_pin, GPIO.OUT)
         GPIO.setup(self.dio0_pin, GPIO.IN)
+        GPIO.add_event_detect(self.dio0_pin, GPIO.RISING, callback=self._on_dio0)
         
         # Reset module
         GPIO.output(self.reset_pin, GPIO.LOW)
@@ -108,7 +137,7 @@ class LoRaDriver:
         # Setup SPI
         self.spi = spidev.SpiDev()
         self.spi.open(self.spi_bus, self.spi_device)
-        self.spi.max_speed_hz = 1_000_000
+        self.spi.max_speed_hz = self.spi_speed_hz
         self.spi.mode = 0
         
         # Check version
@@ -154,15 +183,14 @@ class LoRaDriver:
         self._write_register(REG_SYNC_WORD, self.sync_word)
         
         # Enable CRC
-        config2 = self._read_register(REG_MODEM_CONFIG_2)
-        self._write_register(REG_MODEM_CONFIG_2, config2 | 0x04)
+        self._set_modem_config_2(self._modem_config_2 | 0x04)
         
         # Set preamble length (8 symbols)
         self._write_register(REG_PREAMBLE_MSB, 0x00)
         self._write_register(REG_PREAMBLE_LSB, 0x08)
         
-        # Go to standby
-        self._set_mode(MODE_STDBY)
+        # Listen continuously; the radio only leaves RX to transmit
+        self._start_rx_continuous()
         
         print(f"LoRa: Initialized at {self.frequency/1e6:.1f} MHz, SF{self.spreading_factor}")
         return True
@@ -170,6 +198,7 @@ class LoRaDriver:
     def end(self):
         """Shutdown the LoRa module."""
         self._running = False
+        self._rx_done.set()  # Release any blocked receive()
         if self._rx_thread:
             self._rx_thread.join(timeout=1.0)
         if self.spi:
@@ -183,86 +212,148 @@ class LoRaDriver:
             return False
         
         with self._lock:
-            # Go to standby
-            self._set_mode(MODE_STDBY)
-            
-            # Set FIFO pointer to TX base
-            self._write_register(REG_FIFO_ADDR_PTR, 0x00)
-            
-            # Write data to FIFO
-            for byte in data:
-                self._write_register(REG_FIFO, byte)
-            
-            # Set payload length
-            self._write_register(REG_PAYLOAD_LENGTH, len(data))
-            
-            # Clear IRQ flags
-            self._write_register(REG_IRQ_FLAGS, 0xFF)
-            
-            # Start transmission
-            self._set_mode(MODE_TX)
-            
-            # Wait for TX done
-            start = time.time()
-            while time.time() - start < 5.0:
-                flags = self._read_register(REG_IRQ_FLAGS)
-                if flags & IRQ_TX_DONE:
-                    self._write_register(REG_IRQ_FLAGS, IRQ_TX_DONE)
-                    self._set_mode(MODE_STDBY)
-                    return True
-                time.sleep(0.001)
+            self._save_pending_rx()
+            sent = self._transmit(data)
             
+            # Back to listening
             self._set_mode(MODE_STDBY)
-            return False
+            self._start_rx_continuous()
+            return sent
     
-    def receive(self, timeout_ms: int = 1000) -> Optional[tuple]:
-        """Receive a packet with timeout. Returns (data, rssi) or None."""
+    def send_many(self, packets: List[bytes]) -> int:
+        """
+        Send packets back to back. Returns the number sent successfully.
+        
+        The radio is claimed once for the whole batch and only returns to
+        continuous RX after the last packet.
+        """
+        sent = 0
         with self._lock:
-            # Clear IRQ flags
-            self._write_register(REG_IRQ_FLAGS, 0xFF)
-            
-            # Set to RX single mode
-            self._set_mode(MODE_RX_SINGLE)
-            
-            start = time.time()
-            timeout_sec = timeout_ms / 1000.0
-            
-            while time.time() - start < timeout_sec:
-                flags = self._read_register(REG_IRQ_FLAGS)
-                
-                if flags & IRQ_RX_DONE:
-                    # Check CRC
-                    if flags & IRQ_PAYLOAD_CRC_ERROR:
-                        self._write_register(REG_IRQ_FLAGS, 0xFF)
-                        self._set_mode(MODE_STDBY)
-                        return None
-                    
-                    # Get packet length
-                    length = self._read_register(REG_RX_NB_BYTES)
-                    
-                    # Set FIFO pointer to RX current address
-                    self._write_register(
-                        REG_FIFO_ADDR_PTR,
-                        self._read_register(REG_FIFO_RX_CURRENT_ADDR)
-                    )
-                    
-                    # Read data
-                    data = bytes([self._read_register(REG_FIFO) for _ in range(length)])
-                    
-                    # Get RSSI
-                    rssi = self._read_register(REG_PKT_RSSI_VALUE) - 157
-                    
-                    self._write_register(REG_IRQ_FLAGS, 0xFF)
-                    self._set_mode(MODE_STDBY)
-                    
-                    return (data, rssi)
-                
-                time.sleep(0.001)
+            self._save_pending_rx()
+            for data in packets:
+                if len(data) <= 255 and self._transmit(data):
+                    sent += 1
             
+            # Back to listening
             self._set_mode(MODE_STDBY)
+            self._start_rx_continuous()
+        return sent
+    
+    def _transmit(self, data: bytes) -> bool:
+        """Transmit one packet and wait for TX done. Caller holds _lock."""
+        # Go to standby
+        self._set_mode(MODE_STDBY)
+        
+        # Set FIFO pointer to TX base
+        self._write_register(REG_FIFO_ADDR_PTR, 0x00)
+        
+        # Write data to FIFO (burst: address auto-increments)
+        with self._spi_lock:
+            self.spi.xfer2([REG_FIFO | 0x80] + list(data))
+        
+        # Set payload length
+        self._write_register(REG_PAYLOAD_LENGTH, len(data))
+        
+        # Clear IRQ flags and route TX done to DIO0
+        self._write_register(REG_IRQ_FLAGS, 0xFF)
+        self._write_register(REG_DIO_MAPPING_1, DIO0_TX_DONE)
+        self._tx_done.clear()
+        
+        # Start transmission
+        self._set_mode(MODE_TX)
+        
+        # Wait for TX done interrupt
+        if self._tx_done.wait(timeout=5.0):
+            flags = self._read_register(REG_IRQ_FLAGS)
+            return bool(flags & IRQ_TX_DONE)
+        return False
+    
+    def receive(self, timeout_ms: Optional[int] = None) -> Optional[tuple]:
+        """
+        Wait in continuous RX mode for the next packet.
+        
+        The call sleeps on the DIO0 interrupt instead of polling; with
+        timeout_ms=None it blocks until a packet arrives or the driver is
+        stopped. Returns (data, rssi), or None on timeout or CRC error.
+        """
+        with self._lock:
+            if self._mode != MODE_RX_CONTINUOUS:
+                self._start_rx_continuous()
+        
+        timeout = timeout_ms / 1000.0 if timeout_ms is not None else None
+        if not self._rx_done.wait(timeout=timeout):
             return None
+        
+        with self._lock:
+            if self._pending_rx:
+                # Leave _rx_done set: another packet may be in the FIFO too
+                return self._pending_rx.popleft()
+            self._rx_done.clear()
+            return self._read_packet()
     
-    def start_receive(self, callback: Callable[[bytes, int], None]):
+    def _save_pending_rx(self):
+        """
+        Read out a packet already received in continuous RX before a send
+        takes the radio. Caller holds _lock.
+        
+        TX reuses the FIFO and clears IRQ flags, so without this a packet the
+        RX thread has not collected yet would be lost.
+        """
+        if self._mode != MODE_RX_CONTINUOUS:
+            return
+        if self._read_register(REG_IRQ_FLAGS) & IRQ_RX_DONE:
+            packet = self._read_packet()
+            if packet:
+                self._pending_rx.append(packet)
+    
+    def _start_rx_continuous(self):
+        """Clear IRQs, route RX done to DIO0 and enter continuous RX."""
+        self._write_register(REG_IRQ_FLAGS, 0xFF)
+        self._write_register(REG_DIO_MAPPING_1, DIO0_RX_DONE)
+        self._rx_done.clear()
+        self._set_mode(MODE_RX_CONTINUOUS)
+        if self._pending_rx:
+            self._rx_done.set()
+    
+    def _read_packet(self) -> Optional[tuple]:
+        """
+        Read a received packet from the FIFO and clear IRQ flags.
+        
+        The data is returned as a memoryview so the parser can slice the
+        header and payload out of it without copying.
+        """
+        flags = self._read_register(REG_IRQ_FLAGS)
+        
+        if not flags & IRQ_RX_DONE:
+            return None
+        
+        # Check CRC
+        if flags & IRQ_PAYLOAD_CRC_ERROR:
+            self._write_register(REG_IRQ_FLAGS, 0xFF)
+            return None
+        
+        # Get packet length
+        length = self._read_register(REG_RX_NB_BYTES)
+        
+        # Set FIFO pointer to RX current address
+        self._write_register(
+            REG_FIFO_ADDR_PTR,
+            self._read_register(REG_FIFO_RX_CURRENT_ADDR)
+        )
+        
+        # Read data (burst: address auto-increments)
+        with self._spi_lock:
+            response = self.spi.xfer2([REG_FIFO & 0x7F] + [0x00] * length)
+        data = memoryview(bytearray(response))[1:]
+        
+        # Get RSSI
+        rssi = self._read_register(REG_PKT_RSSI_VALUE) - 157
+        
+        self._write_register(REG_IRQ_FLAGS, 0xFF)
+        
+        return (data, rssi)
+    
+    def start_receive(self, callback: Callable[[memoryview, int], None]):
         """Start continuous receive mode with callback."""
         self._rx_callback = callback
         self._running = True
@@ -272,6 +363,7 @@ class LoRaDriver:
     def stop_receive(self):
         """Stop continuous receive mode."""
         self._running = False
+        self._rx_done.set()  # Release the blocked receive()
         if self._rx_thread:
             self._rx_thread.join(timeout=1.0)
             self._rx_thread = None
@@ -279,30 +371,49 @@ class LoRaDriver:
     def _rx_loop(self):
         """Background receive loop."""
         while self._running:
-            result = self.receive(timeout_ms=100)
+            result = self.receive()
             if result and self._rx_callback:
                 data, rssi = result
                 self._rx_callback(data, rssi)
     
     def _read_register(self, address: int) -> int:
         """Read a single register."""
-        response = self.spi.xfer2([address & 0x7F, 0x00])
+        with self._spi_lock:
+            response = self.spi.xfer2([address & 0x7F, 0x00])
         return response[1]
     
     def _write_register(self, address: int, value: int):
         """Write a single register."""
-        self.spi.xfer2([address | 0x80, value])
+        with self._spi_lock:
+            self.spi.xfer2([address | 0x80, value])
     
     def _set_mode(self, mode: int):
         """Set operating mode."""
+        self._mode = mode
         self._write_register(REG_OP_MODE, 0x80 | mode)
     
+    def _on_dio0(self, channel: int):
+        """DIO0 rising edge: TX done or RX done depending on current mode."""
+        if self._mode == MODE_TX:
+            self._tx_done.set()
+        else:
+            self._rx_done.set()
+    
+    @staticmethod
+    def _compute_frf(freq: int) -> tuple:
+        """FRF register bytes (MSB, MID, LSB) for a carrier frequency."""
+        frf = (freq << 19) // 32_000_000
+        return ((frf >> 16) & 0xFF, (frf >> 8) & 0xFF, frf & 0xFF)
+    
     def _set_frequency(self, freq: int):
         """Set carrier frequency."""
-        frf = int((freq << 19) / 32_000_000)
-        self._write_register(REG_FRF_MSB, (frf >> 16) & 0xFF)
-        self._write_register(REG_FRF_MID, (frf >> 8) & 0xFF)
-        self._write_register(REG_FRF_LSB, frf & 0xFF)
+        if freq == self.frequency:
+            msb, mid, lsb = self._frf_bytes
+        else:
+            msb, mid, lsb = self._compute_frf(freq)
+        self._write_register(REG_FRF_MSB, msb)
+        self._write_register(REG_FRF_MID, mid)
+        self._write_register(REG_FRF_LSB, lsb)
     
     def _set_tx_power(self, power: int):
         """Set TX power (2-20 dBm)."""
@@ -326,8 +437,7 @@ class LoRaDriver:
             self._write_register(REG_DETECTION_OPTIMIZE, 0xC3)
             self._write_register(REG_DETECTION_THRESHOLD, 0x0A)
         
-        config2 = self._read_register(REG_MODEM_CONFIG_2)
-        self._write_register(REG_MODEM_CONFIG_2, (config2 & 0x0F) | (sf << 4))
+        self._set_modem_config_2((self._modem_config_2 & 0x0F) | (sf << 4))
     
     def _set_bandwidth(self, bw: int):
         """Set bandwidth."""
@@ -338,12 +448,20 @@ class LoRaDriver:
         }
         bw_val = bw_map.get(bw, 7)  # Default 125kHz
         
-        config1 = self._read_register(REG_MODEM_CONFIG_1)
-        self._write_register(REG_MODEM_CONFIG_1, (config1 & 0x0F) | (bw_val << 4))
+        self._set_modem_config_1((self._modem_config_1 & 0x0F) | (bw_val << 4))
     
     def _set_coding_rate(self, cr: int):
         """Set coding rate (5-8 for 4/5 to 4/8)."""
         cr = max(5, min(8, cr))
         
-        config1 = self._read_register(REG_MODEM_CONFIG_1)
-        self._write_register(REG_MODEM_CONFIG_1, (config1 & 0xF1) | ((cr - 4) << 1))
+        self._set_modem_config_1((self._modem_config_1 & 0xF1) | ((cr - 4) << 1))
+    
+    def _set_modem_config_1(self, value: int):
+        """Write MODEM_CONFIG_1 and update its shadow."""
+        self._modem_config_1 = value
+        self._write_register(REG_MODEM_CONFIG_1, value)
+    
+    def _set_modem_config_2(self, value: int):
+        """Write MODEM_CONFIG_2 and update its shadow."""
+        self._modem_config_2 = value
+        self._write_register(REG_MODEM_CONFIG_2, value)
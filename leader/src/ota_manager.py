@@ -5,20 +5,22 @@ Manages firmware updates for the IoT device fleet via LoRa.
 Handles announcement broadcasting, chunk sending, and device tracking.
 """
 
+import mmap
 import os
+import stat
 import time
-import random
 import threading
 import logging
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from typing import Dict, Optional, List, Callable
 from enum import IntEnum
-import crcmod
 
 from protocol import (
     Protocol, MessageType, DeviceType, PacketHeader,
     OtaRequest, OtaChunkAck, OtaComplete, OtaStatus,
-    uuid_to_str, crc32_func
+    crc32_func
 )
 
 logger = logging.getLogger(__name__)
@@ -29,6 +31,77 @@ OTA_ANNOUNCE_INTERVAL_SEC = 30
 OTA_CHUNK_TIMEOUT_SEC = 10
 OTA_MAX_RETRIES = 5
 
+# Firmware at least this large is CRC'd as three segments on worker threads
+# (zlib releases the GIL) and the partial CRCs are combined
+OTA_PARALLEL_CRC_MIN_SIZE = 512 * 1024
+OTA_PARALLEL_CRC_STREAMS = 3
+
+# Reflected CRC-32 polynomial (same as zlib)
+_CRC32_POLY = 0xEDB88320
+
+
+def _crc32_multmodp(a: int, b: int) -> int:
+    """Multiply a and b modulo the CRC-32 polynomial (reflected bit order)."""
+    m = 1 << 31
+    p = 0
+    while True:
+        if a & m:
+            p ^= b
+            if not a & (m - 1):
+                break
+        m >>= 1
+        b = (b >> 1) ^ _CRC32_POLY if b & 1 else b >> 1
+    return p
+
+
+def _crc32_x2n_table() -> List[int]:
+    """x^(2^n) modulo the CRC-32 polynomial, for n = 0..31."""
+    table = []
+    p = 1 << 30  # x^1
+    for _ in range(32):
+        table.append(p)
+        p = _crc32_multmodp(p, p)
+    return table
+
+
+_CRC32_X2N = _crc32_x2n_table()
+
+
+def _crc32_combine(crc1: int, crc2: int, len2: int) -> int:
+    """
+    CRC-32 of A + B from crc1 = CRC(A), crc2 = CRC(B) and len2 = len(B).
+    
+    Port of zlib's crc32_combine, which the Python zlib module doesn't expose.
+    """
+    # x^(8 * len2) mod P: shifts crc1 past len2 bytes of zeros
+    p = 1 << 31  # x^0
+    n, k = len2, 3
+    while n:
+        if n & 1:
+            p = _crc32_multmodp(_CRC32_X2N[k & 31], p)
+        n >>= 1
+        k += 1
+    return _crc32_multmodp(p, crc1) ^ crc2
+
+
+def _crc32_parallel(data: bytes) -> int:
+    """CRC-32 of data, split across threads when it is large enough to pay off."""
+    size = len(data)
+    if size < OTA_PARALLEL_CRC_MIN_SIZE or (os.cpu_count() or 1) < 2:
+        return crc32_func(data)
+    
+    view = memoryview(data)
+    step = -(-size // OTA_PARALLEL_CRC_STREAMS)
+    segments = [view[i:i + step] for i in range(0, size, step)]
+    
+    with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        crcs = list(pool.map(crc32_func, segments))
+    
+    crc = crcs[0]
+    for segment, segment_crc in zip(segments[1:], crcs[1:]):
+        crc = _crc32_combine(crc, segment_crc, len(segment))
+    return crc
+
 
 class DeviceOtaState(IntEnum):
     """OTA state for a device."""
@@ -40,6 +113,13 @@ class DeviceOtaState(IntEnum):
     ERROR = 5
 
 
+# States in which a device is expected to answer within OTA_CHUNK_TIMEOUT_SEC
+_WAITING_STATES = frozenset((DeviceOtaState.REQUESTED, DeviceOtaState.RECEIVING))
+
+# State names indexed by value (states are numbered 0..N-1)
+_STATE_NAMES = tuple(state.name for state in DeviceOtaState)
+
+
 @dataclass
 class DeviceOtaInfo:
     """Tracking info for a device during OTA."""
@@ -59,38 +139,73 @@ class OtaSession:
     announce_id: int
     target_device_type: int
     firmware_path: str
-    firmware_data: bytes
     firmware_size: int
     firmware_crc: int
     version: tuple
     total_chunks: int
-    devices: Dict[str, DeviceOtaInfo] = field(default_factory=dict)
+    chunk_payloads: List[bytes] = field(default_factory=list)
+    build_chunk_packet: Optional[Callable[[bytes], bytearray]] = None
+    devices: Dict[bytes, DeviceOtaInfo] = field(default_factory=dict)  # Keyed by raw UUID
+    state_counts: Counter = field(default_factory=Counter)  # Devices per DeviceOtaState
     start_time: float = 0.0
     is_active: bool = False
+    error_message: str = ""  # Set when the session fails to start
 
 
 class OtaManager:
     """Manages OTA firmware updates for device fleet."""
     
-    def __init__(self, protocol: Protocol, send_func: Callable[[bytes], bool]):
+    def __init__(
+        self,
+        protocol: Protocol,
+        send_func: Callable[[bytes], bool],
+        send_batch_func: Optional[Callable[[List[bytes]], int]] = None
+    ):
         """
         Initialize OTA manager.
         
         Args:
             protocol: Protocol instance for packet building
             send_func: Function to send LoRa packets
+            send_batch_func: Optional function to send a list of packets in
+                one go (returns number sent); defaults to calling send_func
         """
         self.protocol = protocol
         self.send = send_func
+        self.send_batch = send_batch_func or self._send_each
         self.session: Optional[OtaSession] = None
+        
+        # Device state is only changed on the announce thread (see
+        # handle_message), so it needs no locking. _lock only guards adding
+        # devices against the API threads that copy the device dict.
         self._lock = threading.Lock()
         self._announce_thread: Optional[threading.Thread] = None
         self._running = False
         
+        # Wakes the announce loop early (device activity or shutdown)
+        self._wake = threading.Event()
+        
+        # Inbound (handler, uuid, payload) items queued by the RX thread and
+        # dispatched by the announce loop; deque append/popleft are atomic
+        self._rx_queue: deque = deque()
+        
+        # Bumped on every progress change so observers can wait instead of poll
+        self.progress_version = 0
+        self._progress_cond = threading.Condition()
+        
         # Callbacks
-        self.on_device_complete: Optional[Callable[[str], None]] = None
+        self.on_device_complete: Optional[Callable[[bytes], None]] = None
         self.on_session_complete: Optional[Callable[[int, int], None]] = None
-        self.on_progress: Optional[Callable[[str, int, int], None]] = None
+        self.on_progress: Optional[Callable[[bytes, int, int], None]] = None
+        
+        # Inbound OTA message type -> handler(uuid, payload)
+        self._handlers: Dict[int, Callable[[bytes, bytes], bool]] = {
+            MessageType.OTA_REQUEST: self._handle_request,
+            MessageType.OTA_CHUNK_ACK: self._handle_chunk_ack,
+            MessageType.OTA_CHUNK_NACK: self._handle_chunk_nack,
+            MessageType.OTA_COMPLETE: self._handle_complete,
+            MessageType.OTA_STATUS: self._handle_status,
+        }
     
     def start_update(
         self,
@@ -112,46 +227,50 @@ class OtaManager:
         if self.session and self.session.is_active:
             raise RuntimeError("OTA session already in progress")
         
-        # Load firmware
         if not os.path.exists(firmware_path):
             raise FileNotFoundError(f"Firmware not found: {firmware_path}")
         
-        with open(firmware_path, 'rb') as f:
-            firmware_data = f.read()
-        
-        firmware_size = len(firmware_data)
-        firmware_crc = crc32_func(firmware_data)
-        total_chunks = (firmware_size + OTA_CHUNK_SIZE - 1) // OTA_CHUNK_SIZE
-        announce_id = random.randint(1, 0xFFFFFFFF)
-        
-        logger.info(
-            f"Starting OTA: {firmware_path}, v{version[0]}.{version[1]}.{version[2]}, "
-            f"{firmware_size} bytes, {total_chunks} chunks, CRC=0x{firmware_crc:08X}"
-        )
-        
+        # Cheap checks stay here so obviously bad firmware fails the call;
+        # only the read and CRC are left to the announcement thread
+        st = os.stat(firmware_path)
+        if not stat.S_ISREG(st.st_mode):
+            raise ValueError(f"Firmware is not a regular file: {firmware_path}")
+        if st.st_size == 0:
+            raise ValueError(f"Firmware is empty: {firmware_path}")
+        if not os.access(firmware_path, os.R_OK):
+            raise PermissionError(f"Firmware not readable: {firmware_path}")
+        
+        # Random nonzero 32-bit id straight from the OS (0 is not a valid id)
+        announce_id = int.from_bytes(os.urandom(4), 'little') or 1
+        
+        # Firmware is loaded by the announcement thread so callers (e.g. the
+        # API) get the announce_id back without waiting on file I/O and CRC
         self.session = OtaSession(
             announce_id=announce_id,
             target_device_type=target_device_type,
             firmware_path=firmware_path,
-            firmware_data=firmware_data,
-            firmware_size=firmware_size,
-            firmware_crc=firmware_crc,
+            firmware_size=0,
+            firmware_crc=0,
             version=version,
-            total_chunks=total_chunks,
+            total_chunks=0,
             start_time=time.time(),
             is_active=True
         )
         
         # Start announcement thread
         self._running = True
+        self._wake.clear()
+        self._rx_queue.clear()
         self._announce_thread = threading.Thread(target=self._announce_loop, daemon=True)
         self._announce_thread.start()
         
+        self._notify_progress()
         return announce_id
     
     def stop_update(self):
         """Stop the current OTA session."""
         self._running = False
+        self._wake.set()
         if self._announce_thread:
             self._announce_thread.join(timeout=2.0)
             self._announce_thread = None
@@ -163,48 +282,57 @@ class OtaManager:
             
             logger.info(f"OTA session {self.session.announce_id} stopped")
             self.session.is_active = False
+            self._notify_progress()
     
     def handle_message(self, header: PacketHeader, payload: bytes) -> bool:
         """
-        Handle an incoming OTA-related message.
+        Queue an incoming OTA-related message for the announce loop.
+        
+        Called from the radio RX thread; the message is only enqueued here so
+        the receiver never waits on OTA state handling.
         
-        Returns True if message was handled.
+        Returns True if message was accepted.
         """
         if not self.session or not self.session.is_active:
             return False
         
-        uuid_str = uuid_to_str(header.uuid)
+        handler = self._handlers.get(header.msg_type)
+        if handler is None:
+            return False
         
-        if header.msg_type == MessageType.OTA_REQUEST:
-            return self._handle_request(uuid_str, header.uuid, payload)
-        elif header.msg_type == MessageType.OTA_CHUNK_ACK:
-            return self._handle_chunk_ack(uuid_str, payload)
-        elif header.msg_type == MessageType.OTA_CHUNK_NACK:
-            return self._handle_chunk_nack(uuid_str, payload)
-        elif header.msg_type == MessageType.OTA_COMPLETE:
-            return self._handle_complete(uuid_str, payload)
-        elif header.msg_type == MessageType.OTA_STATUS:
-            return self._handle_status(uuid_str, payload)
+        # Copy the payload; the caller's buffer is not ours to keep
+        self._rx_queue.append((handler, header.uuid, bytes(payload)))
+        self._wake.set()
+        return True
+    
+    def _drain_rx_queue(self):
+        """Dispatch queued inbound messages (announce thread only)."""
+        queue = self._rx_queue
+        while True:
+            try:
+                handler, uuid, payload = queue.popleft()
+            except IndexError:
+                break
+            handler(uuid, payload)
+    
+    def wait_for_progress(self, version: int, timeout: Optional[float] = None) -> int:
+        """
+        Block until progress_version differs from version or timeout expires.
         
-        return False
+        Returns the current progress_version.
+        """
+        with self._progress_cond:
+            self._progress_cond.wait_for(
+                lambda: self.progress_version != version, timeout
+            )
+            return self.progress_version
     
     def get_progress(self) -> dict:
         """Get current OTA progress."""
         if not self.session:
             return {"active": False}
         
-        devices_complete = sum(
-            1 for d in self.session.devices.values()
-            if d.state == DeviceOtaState.COMPLETE
-        )
-        devices_error = sum(
-            1 for d in self.session.devices.values()
-            if d.state == DeviceOtaState.ERROR
-        )
-        devices_receiving = sum(
-            1 for d in self.session.devices.values()
-            if d.state == DeviceOtaState.RECEIVING
-        )
+        counts = self.session.state_counts
         
         return {
             "active": self.session.is_active,
@@ -213,10 +341,11 @@ class OtaManager:
             "firmware_size": self.session.firmware_size,
             "total_chunks": self.session.total_chunks,
             "devices_total": len(self.session.devices),
-            "devices_complete": devices_complete,
-            "devices_error": devices_error,
-            "devices_receiving": devices_receiving,
-            "elapsed_sec": int(time.time() - self.session.start_time)
+            "devices_complete": counts[DeviceOtaState.COMPLETE],
+            "devices_error": counts[DeviceOtaState.ERROR],
+            "devices_receiving": counts[DeviceOtaState.RECEIVING],
+            "elapsed_sec": int(time.time() - self.session.start_time),
+            "error": self.session.error_message
         }
     
     def get_device_status(self) -> List[dict]:
@@ -225,14 +354,14 @@ class OtaManager:
             return []
         
         result = []
-        for uuid_str, info in self.session.devices.items():
+        for uuid, info in self._device_snapshot():
             progress = 0
             if self.session.total_chunks > 0 and info.last_chunk_acked >= 0:
                 progress = int((info.last_chunk_acked + 1) * 100 / self.session.total_chunks)
             
             result.append({
-                "uuid": uuid_str,
-                "state": info.state.name,
+                "uuid": uuid.hex(),
+                "state": _STATE_NAMES[info.state],
                 "current_version": f"{info.current_version[0]}.{info.current_version[1]}.{info.current_version[2]}",
                 "progress": progress,
                 "last_chunk": info.last_chunk_acked,
@@ -242,25 +371,86 @@ class OtaManager:
         
         return result
     
+    def _load_firmware(self) -> bool:
+        """Map the session firmware, compute its CRC and build chunk payloads."""
+        session = self.session
+        try:
+            # Map firmware read-only; everything below reads the page cache
+            # directly and the mapping is gone once the payloads are built
+            with open(session.firmware_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as firmware_map:
+                self._build_chunks(session, firmware_map)
+        except (OSError, ValueError) as e:
+            # mmap raises ValueError for an empty file
+            logger.error(f"Failed to load firmware {session.firmware_path}: {e}")
+            session.error_message = f"Failed to load firmware: {e}"
+            return False
+        
+        logger.info(
+            f"Starting OTA: {session.firmware_path}, "
+            f"v{session.version[0]}.{session.version[1]}.{session.version[2]}, "
+            f"{session.firmware_size} bytes, {session.total_chunks} chunks, "
+            f"CRC=0x{session.firmware_crc:08X}"
+        )
+        return True
+    
+    def _build_chunks(self, session: OtaSession, firmware: mmap.mmap):
+        """Fill in size, CRC and prebuilt chunk payloads from the firmware image."""
+        session.firmware_size = len(firmware)
+        session.firmware_crc = _crc32_parallel(firmware)
+        session.total_chunks = (session.firmware_size + OTA_CHUNK_SIZE - 1) // OTA_CHUNK_SIZE
+        
+        # Chunks are resent per device and on every retry; build each payload
+        # (header + CRC16) once and only add a fresh packet header per send.
+        # Chunk views are released as we go so the mapping can be closed.
+        session.chunk_payloads = []
+        with memoryview(firmware) as firmware_view:
+            for i in range(session.total_chunks):
+                with firmware_view[i * OTA_CHUNK_SIZE:(i + 1) * OTA_CHUNK_SIZE] as chunk:
+                    session.chunk_payloads.append(
+                        self.protocol.build_ota_chunk_payload(session.announce_id, i, chunk)
+                    )
+        session.build_chunk_packet = self.protocol.make_packet_builder(MessageType.OTA_CHUNK)
+    
     def _announce_loop(self):
         """Background thread to periodically broadcast announcements."""
+        if not self._load_firmware():
+            self.session.is_active = False
+            self._running = False
+            self._notify_progress()
+            return
+        self._notify_progress()
+        
+        next_announce = time.monotonic()
         while self._running and self.session and self.session.is_active:
-            self._send_announce()
+            # Packets from one pass are collected and sent as a single batch
+            batch: List[bytes] = []
+            
+            # Handle device messages queued by the RX thread since the last pass
+            self._drain_rx_queue()
+            if not self.session.is_active:
+                break
+            
+            # Early wake-ups only service devices; announces keep their interval
+            now = time.monotonic()
+            if now >= next_announce:
+                self._send_announce(batch)
+                next_announce = now + OTA_ANNOUNCE_INTERVAL_SEC
             
             # Also check for devices that need chunks
-            self._process_pending_chunks()
+            self._process_pending_chunks(batch)
             
             # Check for timeouts
-            self._check_timeouts()
+            self._check_timeouts(batch)
+            
+            self.send_batch(batch)
             
-            # Sleep before next announce
-            for _ in range(OTA_ANNOUNCE_INTERVAL_SEC * 10):
-                if not self._running:
-                    break
-                time.sleep(0.1)
+            # Sleep until the next announce or until woken
+            self._wake.wait(timeout=max(0.0, next_announce - time.monotonic()))
+            self._wake.clear()
     
-    def _send_announce(self):
-        """Send OTA announcement broadcast."""
+    def _send_announce(self, batch: Optional[List[bytes]] = None):
+        """Send OTA announcement broadcast (or append it to batch)."""
         if not self.session:
             return
         
@@ -272,241 +462,259 @@ class OtaManager:
             announce_id=self.session.announce_id
         )
         
-        self.send(packet)
-        logger.debug(f"Sent OTA announce {self.session.announce_id}")
+        self._send_or_batch(packet, batch)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sent OTA announce %d", self.session.announce_id)
     
-    def _handle_request(self, uuid_str: str, uuid: bytes, payload: bytes) -> bool:
+    def _handle_request(self, uuid: bytes, payload: bytes) -> bool:
         """Handle OTA request from device."""
         request = self.protocol.parse_ota_request(payload)
         if not request or request.announce_id != self.session.announce_id:
             return False
         
+        # Adding a device changes the dict other threads snapshot: take _lock
         with self._lock:
-            # Create or update device info
-            if uuid_str not in self.session.devices:
-                self.session.devices[uuid_str] = DeviceOtaInfo(uuid=uuid)
-            
-            device = self.session.devices[uuid_str]
-            device.current_version = (
-                request.current_version_major,
-                request.current_version_minor,
-                request.current_version_patch
-            )
-            device.state = DeviceOtaState.REQUESTED
-            device.last_activity = time.time()
-            
-            # Determine starting chunk
-            if request.last_chunk_received == 0xFFFF:
-                start_chunk = 0
-            else:
-                start_chunk = request.last_chunk_received + 1
-            
-            device.last_chunk_acked = start_chunk - 1
-            
-            logger.info(
-                f"OTA request from {uuid_str[:16]}..., "
-                f"v{device.current_version[0]}.{device.current_version[1]}.{device.current_version[2]}, "
-                f"starting at chunk {start_chunk}"
-            )
+            device = self.session.devices.get(uuid)
+            if device is None:
+                device = DeviceOtaInfo(uuid=uuid)
+                self.session.devices[uuid] = device
+                self.session.state_counts[device.state] += 1
+        
+        device.current_version = (
+            request.current_version_major,
+            request.current_version_minor,
+            request.current_version_patch
+        )
+        self._set_state(device, DeviceOtaState.REQUESTED)
+        device.last_activity = time.time()
+        
+        # Determine starting chunk
+        if request.last_chunk_received == 0xFFFF:
+            start_chunk = 0
+        else:
+            start_chunk = request.last_chunk_received + 1
+        
+        device.last_chunk_acked = start_chunk - 1
+        
+        logger.info(
+            "OTA request from %s..., v%d.%d.%d, starting at chunk %d",
+            uuid[:8].hex(), *device.current_version, start_chunk
+        )
+        
+        self._notify_progress()
         
         # Send first chunk
-        self._send_chunk(uuid_str, start_chunk)
+        self._send_chunk(uuid, start_chunk)
         return True
     
-    def _handle_chunk_ack(self, uuid_str: str, payload: bytes) -> bool:
+    def _handle_chunk_ack(self, uuid: bytes, payload: bytes) -> bool:
         """Handle chunk ACK from device."""
         ack = self.protocol.parse_ota_chunk_ack(payload)
         if not ack or ack.announce_id != self.session.announce_id:
             return False
         
-        with self._lock:
-            if uuid_str not in self.session.devices:
-                return False
-            
-            device = self.session.devices[uuid_str]
-            
-            if ack.status == 0:  # OK
-                device.last_chunk_acked = ack.chunk_index
-                device.state = DeviceOtaState.RECEIVING
-                device.last_activity = time.time()
-                device.retry_count = 0
-                
-                # Report progress
-                if self.on_progress:
-                    self.on_progress(uuid_str, ack.chunk_index + 1, self.session.total_chunks)
-                
-                logger.debug(
-                    f"Chunk {ack.chunk_index + 1}/{self.session.total_chunks} "
-                    f"ACKed by {uuid_str[:16]}..."
-                )
-                
-                # Send next chunk if not done
-                next_chunk = ack.chunk_index + 1
-                if next_chunk < self.session.total_chunks:
-                    self._send_chunk(uuid_str, next_chunk)
-            else:
-                # Error - will be retried
-                logger.warning(f"Chunk {ack.chunk_index} error from {uuid_str[:16]}...: {ack.status}")
+        device = self.session.devices.get(uuid)
+        if device is None:
+            return False
+        
+        if ack.status != 0:
+            # Error - will be retried
+            logger.warning("Chunk %d error from %s...: %d", ack.chunk_index, uuid[:8].hex(), ack.status)
+            return True
+        
+        device.last_chunk_acked = ack.chunk_index
+        self._set_state(device, DeviceOtaState.RECEIVING)
+        device.last_activity = time.time()
+        device.retry_count = 0
+        
+        # Report progress
+        if self.on_progress:
+            self.on_progress(uuid, ack.chunk_index + 1, self.session.total_chunks)
+        self._notify_progress()
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Chunk %d/%d ACKed by %s...",
+                ack.chunk_index + 1, self.session.total_chunks, uuid[:8].hex()
+            )
         
+        # Send next chunk if not done
+        next_chunk = ack.chunk_index + 1
+        if next_chunk < self.session.total_chunks:
+            self._send_chunk(uuid, next_chunk)
         return True
     
-    def _handle_chunk_nack(self, uuid_str: str, payload: bytes) -> bool:
+    def _handle_chunk_nack(self, uuid: bytes, payload: bytes) -> bool:
         """Handle chunk NACK (resend request) from device."""
         ack = self.protocol.parse_ota_chunk_ack(payload)
         if not ack or ack.announce_id != self.session.announce_id:
             return False
         
-        with self._lock:
-            if uuid_str not in self.session.devices:
-                return False
-            
-            device = self.session.devices[uuid_str]
-            device.last_activity = time.time()
-            device.retry_count += 1
-            
-            if device.retry_count > OTA_MAX_RETRIES:
-                device.state = DeviceOtaState.ERROR
-                device.error_message = "Max retries exceeded"
-                logger.error(f"Device {uuid_str[:16]}... exceeded max retries")
-                return True
+        device = self.session.devices.get(uuid)
+        if device is None:
+            return False
+        
+        device.last_activity = time.time()
+        device.retry_count += 1
+        
+        if device.retry_count > OTA_MAX_RETRIES:
+            self._set_state(device, DeviceOtaState.ERROR)
+            device.error_message = "Max retries exceeded"
+            logger.error("Device %s... exceeded max retries", uuid[:8].hex())
+            self._notify_progress()
+            return True
         
         # Resend the requested chunk
-        logger.info(f"Resending chunk {ack.chunk_index} to {uuid_str[:16]}...")
-        self._send_chunk(uuid_str, ack.chunk_index)
+        logger.info("Resending chunk %d to %s...", ack.chunk_index, uuid[:8].hex())
+        self._send_chunk(uuid, ack.chunk_index)
         return True
     
-    def _handle_complete(self, uuid_str: str, payload: bytes) -> bool:
+    def _handle_complete(self, uuid: bytes, payload: bytes) -> bool:
         """Handle OTA complete from device."""
         complete = self.protocol.parse_ota_complete(payload)
         if not complete or complete.announce_id != self.session.announce_id:
             return False
         
-        with self._lock:
-            if uuid_str not in self.session.devices:
-                return False
-            
-            device = self.session.devices[uuid_str]
-            device.last_activity = time.time()
-            
-            if complete.status == 0:  # CRC OK
-                device.state = DeviceOtaState.COMPLETE
-                logger.info(f"Device {uuid_str[:16]}... completed OTA successfully")
-                
-                if self.on_device_complete:
-                    self.on_device_complete(uuid_str)
-            else:
-                device.state = DeviceOtaState.ERROR
-                device.error_message = "CRC mismatch"
-                logger.error(f"Device {uuid_str[:16]}... CRC mismatch")
+        device = self.session.devices.get(uuid)
+        if device is None:
+            return False
+        
+        device.last_activity = time.time()
+        
+        if complete.status == 0:  # CRC OK
+            self._set_state(device, DeviceOtaState.COMPLETE)
+            logger.info("Device %s... completed OTA successfully", uuid[:8].hex())
             
-            # Check if all devices are done
-            self._check_session_complete()
+            if self.on_device_complete:
+                self.on_device_complete(uuid)
+        else:
+            self._set_state(device, DeviceOtaState.ERROR)
+            device.error_message = "CRC mismatch"
+            logger.error("Device %s... CRC mismatch", uuid[:8].hex())
+        
+        self._notify_progress()
+        
+        # Check if all devices are done
+        self._check_session_complete()
         
         return True
     
-    def _handle_status(self, uuid_str: str, payload: bytes) -> bool:
+    def _handle_status(self, uuid: bytes, payload: bytes) -> bool:
         """Handle OTA status from device."""
         status = self.protocol.parse_ota_status(payload)
         if not status or status.announce_id != self.session.announce_id:
             return False
         
-        with self._lock:
-            if uuid_str not in self.session.devices:
-                return False
-            
-            device = self.session.devices[uuid_str]
-            device.last_activity = time.time()
-            
-            logger.info(
-                f"Status from {uuid_str[:16]}...: "
-                f"{status.chunks_received}/{status.total_chunks} chunks, "
-                f"state={status.state}, error={status.error_code}"
-            )
+        device = self.session.devices.get(uuid)
+        if device is None:
+            return False
+        
+        device.last_activity = time.time()
+        
+        logger.info(
+            "Status from %s...: %d/%d chunks, state=%d, error=%d",
+            uuid[:8].hex(), status.chunks_received, status.total_chunks,
+            status.state, status.error_code
+        )
         
         return True
     
-    def _send_chunk(self, uuid_str: str, chunk_index: int):
-        """Send a firmware chunk to a device."""
+    def _send_chunk(self, uuid: bytes, chunk_index: int, batch: Optional[List[bytes]] = None):
+        """Send a firmware chunk to a device (or append it to batch)."""
         if not self.session or chunk_index >= self.session.total_chunks:
             return
         
-        # Calculate chunk data
-        start = chunk_index * OTA_CHUNK_SIZE
-        end = min(start + OTA_CHUNK_SIZE, self.session.firmware_size)
-        chunk_data = self.session.firmware_data[start:end]
+        # Wrap the prebuilt payload with a new header (fresh sequence number)
+        packet = self.session.build_chunk_packet(self.session.chunk_payloads[chunk_index])
         
-        # Build and send packet
-        packet = self.protocol.build_ota_chunk(
-            announce_id=self.session.announce_id,
-            chunk_index=chunk_index,
-            data=chunk_data
-        )
-        
-        self.send(packet)
+        self._send_or_batch(packet, batch)
         
-        with self._lock:
-            if uuid_str in self.session.devices:
-                self.session.devices[uuid_str].last_chunk_sent = chunk_index
+        device = self.session.devices.get(uuid)
+        if device is not None:
+            device.last_chunk_sent = chunk_index
     
-    def _process_pending_chunks(self):
+    def _process_pending_chunks(self, batch: Optional[List[bytes]] = None):
         """Send chunks to devices that are waiting."""
         if not self.session:
             return
         
-        with self._lock:
-            for uuid_str, device in self.session.devices.items():
-                if device.state == DeviceOtaState.RECEIVING:
-                    # Check if we need to send next chunk
-                    next_chunk = device.last_chunk_acked + 1
-                    if next_chunk < self.session.total_chunks:
-                        if device.last_chunk_sent < next_chunk:
-                            self._send_chunk(uuid_str, next_chunk)
+        for uuid, device in self.session.devices.items():
+            # Check if we need to send next chunk
+            next_chunk = device.last_chunk_acked + 1
+            due = (
+                device.state == DeviceOtaState.RECEIVING
+                and next_chunk < self.session.total_chunks
+                and device.last_chunk_sent < next_chunk
+            )
+            if due:
+                self._send_chunk(uuid, next_chunk, batch)
     
-    def _check_timeouts(self):
+    def _check_timeouts(self, batch: Optional[List[bytes]] = None):
         """Check for device timeouts."""
         if not self.session:
             return
         
         now = time.time()
+        deadline = now - OTA_CHUNK_TIMEOUT_SEC
         
+        for uuid, device in self.session.devices.items():
+            if device.state not in _WAITING_STATES or device.last_activity >= deadline:
+                continue
+            
+            device.retry_count += 1
+            
+            if device.retry_count > OTA_MAX_RETRIES:
+                self._set_state(device, DeviceOtaState.ERROR)
+                device.error_message = "Timeout"
+                logger.error("Device %s... timed out", uuid[:8].hex())
+                self._notify_progress()
+                continue
+            
+            # Resend last chunk
+            chunk = device.last_chunk_acked + 1
+            if chunk < self.session.total_chunks:
+                device.last_activity = now
+                logger.info("Timeout, resending chunk %d to %s...", chunk, uuid[:8].hex())
+                self._send_chunk(uuid, chunk, batch)
+    
+    def _set_state(self, device: DeviceOtaInfo, state: DeviceOtaState):
+        """Set a device's state, keeping state_counts in step."""
+        if device.state == state:
+            return
+        counts = self.session.state_counts
+        counts[device.state] -= 1
+        counts[state] += 1
+        device.state = state
+    
+    def _device_snapshot(self) -> List[tuple]:
+        """Copy of the session's (uuid, device) pairs, safe to iterate from other threads."""
         with self._lock:
-            for uuid_str, device in self.session.devices.items():
-                if device.state in (DeviceOtaState.REQUESTED, DeviceOtaState.RECEIVING):
-                    if now - device.last_activity > OTA_CHUNK_TIMEOUT_SEC:
-                        device.retry_count += 1
-                        
-                        if device.retry_count > OTA_MAX_RETRIES:
-                            device.state = DeviceOtaState.ERROR
-                            device.error_message = "Timeout"
-                            logger.error(f"Device {uuid_str[:16]}... timed out")
-                        else:
-                            # Resend last chunk
-                            chunk = device.last_chunk_acked + 1
-                            if chunk < self.session.total_chunks:
-                                logger.info(f"Timeout, resending chunk {chunk} to {uuid_str[:16]}...")
-                                device.last_activity = now
-                                self._send_chunk(uuid_str, chunk)
+            return list(self.session.devices.items())
+    
+    def _send_or_batch(self, packet: bytes, batch: Optional[List[bytes]]):
+        """Send packet now, or append it to batch when one is given."""
+        if batch is None:
+            self.send(packet)
+        else:
+            batch.append(packet)
+    
+    def _send_each(self, packets: List[bytes]) -> int:
+        """Fallback batch sender: send packets one at a time."""
+        return sum(1 for packet in packets if self.send(packet))
     
     def _check_session_complete(self):
         """Check if all devices have completed."""
         if not self.session:
             return
         
-        all_done = all(
-            d.state in (DeviceOtaState.COMPLETE, DeviceOtaState.ERROR)
-            for d in self.session.devices.values()
-        )
+        if not self.session.is_active:
+            return
         
-        if all_done and len(self.session.devices) > 0:
-            complete_count = sum(
-                1 for d in self.session.devices.values()
-                if d.state == DeviceOtaState.COMPLETE
-            )
-            error_count = sum(
-                1 for d in self.session.devices.values()
-                if d.state == DeviceOtaState.ERROR
-            )
-            
+        counts = self.session.state_counts
+        complete_count = counts[DeviceOtaState.COMPLETE]
+        error_count = counts[DeviceOtaState.ERROR]
+        
+        if self.session.devices and complete_count + error_count >= len(self.session.devices):
             logger.info(
                 f"OTA session complete: {complete_count} success, {error_count} errors"
             )
@@ -516,3 +724,11 @@ class OtaManager:
             
             self.session.is_active = False
             self._running = False
+            self._wake.set()
+            self._notify_progress()
+    
+    def _notify_progress(self):
+        """Bump progress_version and wake any waiting observers."""
+        with self._progress_cond:
+            self.progress_version += 1
+            self._progress_cond.notify_all()
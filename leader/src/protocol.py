@@ -5,17 +5,25 @@ Defines packet structures and message types matching the device firmware.
 """
 
 import struct
+import zlib
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Callable
 from enum import IntEnum
 import crcmod
 
 # Protocol constants
-MAGIC = b'\xAG\x5Y'  # Will be encoded as bytes
+MAGIC = b'AG'
 PROTOCOL_VERSION = 1
 
-# CRC functions
-crc32_func = crcmod.predefined.mkCrcFun('crc-32')
+# First three header bytes of every valid packet, checked in one compare
+MAGIC_VERSION = MAGIC + bytes([PROTOCOL_VERSION])
+
+# OTA abort payload (announce_id only)
+_ANNOUNCE_ID_STRUCT = struct.Struct('<I')
+
+# CRC functions. zlib's CRC-32 is the same IEEE 802.3 CRC as crcmod's
+# 'crc-32' but runs in C (hardware-accelerated where zlib supports it).
+crc32_func = zlib.crc32
 crc16_func = crcmod.mkCrcFun(0x11021, initCrc=0xFFFF, xorOut=0x0000)
 
 
@@ -73,11 +81,11 @@ class PacketHeader:
     payload_len: int
     
     FORMAT = '<2sBBB16sHB'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     def pack(self) -> bytes:
-        return struct.pack(
-            self.FORMAT,
+        return self._STRUCT.pack(
             self.magic,
             self.version,
             self.msg_type,
@@ -89,7 +97,7 @@ class PacketHeader:
     
     @classmethod
     def unpack(cls, data: bytes) -> 'PacketHeader':
-        fields = struct.unpack(cls.FORMAT, data[:cls.SIZE])
+        fields = cls._STRUCT.unpack_from(data)
         return cls(*fields)
 
 
@@ -106,11 +114,12 @@ class SensorReport:
     flags: int
     
     FORMAT = '<IHBHHHBB'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     @classmethod
     def unpack(cls, data: bytes) -> 'SensorReport':
-        fields = struct.unpack(cls.FORMAT, data[:cls.SIZE])
+        fields = cls._STRUCT.unpack_from(data)
         return cls(*fields)
 
 
@@ -122,10 +131,11 @@ class AckPayload:
     flags: int
     
     FORMAT = '<HBB'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     def pack(self) -> bytes:
-        return struct.pack(self.FORMAT, self.acked_sequence, self.status, self.flags)
+        return self._STRUCT.pack(self.acked_sequence, self.status, self.flags)
 
 
 @dataclass
@@ -140,12 +150,12 @@ class OtaAnnounce:
     firmware_crc: int
     announce_id: int
     
-    FORMAT = '<BBBBIHI I'
-    SIZE = struct.calcsize(FORMAT)
+    FORMAT = '<BBBBIHII'
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     def pack(self) -> bytes:
-        return struct.pack(
-            '<BBBBIHII',
+        return self._STRUCT.pack(
             self.target_device_type,
             self.version_major,
             self.version_minor,
@@ -167,11 +177,12 @@ class OtaRequest:
     last_chunk_received: int
     
     FORMAT = '<IBBBH'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     @classmethod
     def unpack(cls, data: bytes) -> 'OtaRequest':
-        fields = struct.unpack(cls.FORMAT, data[:cls.SIZE])
+        fields = cls._STRUCT.unpack_from(data)
         return cls(*fields)
 
 
@@ -185,11 +196,11 @@ class OtaChunk:
     data: bytes
     
     HEADER_FORMAT = '<IHHH'
-    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+    _HEADER_STRUCT = struct.Struct(HEADER_FORMAT)
+    HEADER_SIZE = _HEADER_STRUCT.size
     
     def pack(self) -> bytes:
-        header = struct.pack(
-            self.HEADER_FORMAT,
+        header = self._HEADER_STRUCT.pack(
             self.announce_id,
             self.chunk_index,
             self.chunk_size,
@@ -206,11 +217,12 @@ class OtaChunkAck:
     status: int
     
     FORMAT = '<IHB'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     @classmethod
     def unpack(cls, data: bytes) -> 'OtaChunkAck':
-        fields = struct.unpack(cls.FORMAT, data[:cls.SIZE])
+        fields = cls._STRUCT.unpack_from(data)
         return cls(*fields)
 
 
@@ -222,11 +234,12 @@ class OtaComplete:
     status: int
     
     FORMAT = '<IIB'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     @classmethod
     def unpack(cls, data: bytes) -> 'OtaComplete':
-        fields = struct.unpack(cls.FORMAT, data[:cls.SIZE])
+        fields = cls._STRUCT.unpack_from(data)
         return cls(*fields)
 
 
@@ -240,11 +253,12 @@ class OtaStatus:
     error_code: int
     
     FORMAT = '<IHHBB'
-    SIZE = struct.calcsize(FORMAT)
+    _STRUCT = struct.Struct(FORMAT)
+    SIZE = _STRUCT.size
     
     @classmethod
     def unpack(cls, data: bytes) -> 'OtaStatus':
-        fields = struct.unpack(cls.FORMAT, data[:cls.SIZE])
+        fields = cls._STRUCT.unpack_from(data)
         return cls(*fields)
 
 
@@ -259,20 +273,51 @@ class Protocol:
         self.sequence = (self.sequence + 1) & 0xFFFF
         return self.sequence
     
-    def build_packet(self, msg_type: MessageType, payload: bytes) -> bytes:
-        """Build a complete packet with header."""
-        header = PacketHeader(
-            magic=b'AG',
-            version=PROTOCOL_VERSION,
-            msg_type=msg_type,
-            device_type=0x00,  # Controller
-            uuid=self.uuid,
-            sequence=self.next_sequence(),
-            payload_len=len(payload)
+    def build_packet(self, msg_type: MessageType, payload: bytes) -> bytearray:
+        """Build a complete packet with header, as a new bytearray per call."""
+        # Header and payload are written into one preallocated buffer
+        payload_len = len(payload)
+        packet = bytearray(PacketHeader.SIZE + payload_len)
+        PacketHeader._STRUCT.pack_into(
+            packet, 0,
+            MAGIC,
+            PROTOCOL_VERSION,
+            msg_type,
+            0x00,  # Controller
+            self.uuid,
+            self.next_sequence(),
+            payload_len
         )
-        return header.pack() + payload
+        packet[PacketHeader.SIZE:] = payload
+        return packet
     
-    def build_ack(self, sequence: int, status: int = 0, flags: int = 0) -> bytes:
+    def make_packet_builder(self, msg_type: MessageType) -> Callable[[bytes], bytearray]:
+        """
+        Return build_packet specialized for one message type.
+        
+        The header layout, message type and controller UUID are bound once;
+        each call only takes a sequence number and copies the payload.
+        """
+        pack_into = PacketHeader._STRUCT.pack_into
+        header_size = PacketHeader.SIZE
+        msg_type = int(msg_type)
+        uuid = self.uuid
+        next_sequence = self.next_sequence
+        
+        def build(payload: bytes) -> bytearray:
+            payload_len = len(payload)
+            packet = bytearray(header_size + payload_len)
+            pack_into(
+                packet, 0,
+                MAGIC, PROTOCOL_VERSION, msg_type, 0x00, uuid,
+                next_sequence(), payload_len
+            )
+            packet[header_size:] = payload
+            return packet
+        
+        return build
+    
+    def build_ack(self, sequence: int, status: int = 0, flags: int = 0) -> bytearray:
         """Build an ACK packet."""
         payload = AckPayload(sequence, status, flags).pack()
         return self.build_packet(MessageType.ACK, payload)
@@ -284,7 +329,7 @@ class Protocol:
         firmware_size: int,
         firmware_crc: int,
         announce_id: int
-    ) -> bytes:
+    ) -> bytearray:
         """Build an OTA announce packet."""
         total_chunks = (firmware_size + 199) // 200  # 200 bytes per chunk
         payload = OtaAnnounce(
@@ -304,30 +349,52 @@ class Protocol:
         announce_id: int,
         chunk_index: int,
         data: bytes
-    ) -> bytes:
+    ) -> bytearray:
         """Build an OTA chunk packet."""
-        chunk_crc = crc16_func(data)
-        payload = OtaChunk(
+        payload = self.build_ota_chunk_payload(announce_id, chunk_index, data)
+        return self.build_packet(MessageType.OTA_CHUNK, payload)
+    
+    def build_ota_chunk_payload(
+        self,
+        announce_id: int,
+        chunk_index: int,
+        data: bytes
+    ) -> bytes:
+        """
+        Build an OTA chunk payload (chunk header, CRC16 and data).
+        
+        The payload is the same for every transmission of a chunk, so it
+        can be built once and wrapped with build_packet on each send.
+        """
+        return OtaChunk(
             announce_id=announce_id,
             chunk_index=chunk_index,
             chunk_size=len(data),
-            chunk_crc=chunk_crc,
+            chunk_crc=crc16_func(data),
             data=data
         ).pack()
-        return self.build_packet(MessageType.OTA_CHUNK, payload)
     
-    def build_ota_abort(self, announce_id: int) -> bytes:
+    def build_ota_abort(self, announce_id: int) -> bytearray:
         """Build an OTA abort packet."""
-        payload = struct.pack('<I', announce_id)
+        payload = _ANNOUNCE_ID_STRUCT.pack(announce_id)
         return self.build_packet(MessageType.OTA_ABORT, payload)
     
-    def parse_packet(self, data: bytes) -> Optional[Tuple[PacketHeader, bytes]]:
-        """Parse a received packet. Returns (header, payload) or None."""
+    def parse_packet(self, data: bytes) -> Optional[Tuple[PacketHeader, memoryview]]:
+        """
+        Parse a received packet. Returns (header, payload) or None.
+        
+        The payload is a memoryview into data, not a copy.
+        """
         if len(data) < PacketHeader.SIZE:
             return None
         
-        header = PacketHeader.unpack(data)
-        payload = data[PacketHeader.SIZE:PacketHeader.SIZE + header.payload_len]
+        # Reject foreign traffic and other protocol versions before unpacking
+        if data[:3] != MAGIC_VERSION:
+            return None
+        
+        view = memoryview(data)
+        header = PacketHeader.unpack(view)
+        payload = view[PacketHeader.SIZE:PacketHeader.SIZE + header.payload_len]
         
         return (header, payload)
     